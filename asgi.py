@@ -0,0 +1,139 @@
+"""
+ASGI-вход для бота – альтернатива Flask-вебхуку из main.py:
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+
+Вебхук сразу отвечает Telegram 200, а апдейт обрабатывается в фоне.
+Апдейты одного чата идут строго по очереди (asyncio.Lock на chat_id),
+разных чатов – параллельно. Данные пользователя грузятся асинхронно
+(storage.load_data_async), а синхронные хендлеры telebot из main.py
+выполняются в пуле потоков, поэтому медленный Dropbox у одного чата
+не задерживает остальные.
+
+Раз Telegram уже получил 200, повторно он апдейт не пришлёт: при остановке
+(lifespan.shutdown) дожидаемся всех начатых апдейтов, сколько бы они ни
+шли. Если процесс убьют раньше (SIGKILL, таймаут остановки платформы),
+необработанные апдейты теряются.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+
+import main
+import write_behind
+from bot import telegram_async
+from storage import tasks_by_user, load_data_async
+
+HANDLER_WORKERS = int(os.environ.get("ASGI_HANDLER_WORKERS", "16"))
+BASE_URL = os.environ.get("BASE_URL", "https://smart-planner-bot.onrender.com")
+
+# Хендлеры выполняем сами в своём пуле (main.bot создан с threaded=False):
+# process_new_updates возвращается, только когда хендлер отработал,
+# иначе очередь апдейтов чата теряла бы смысл.
+_pool = ThreadPoolExecutor(max_workers=HANDLER_WORKERS, thread_name_prefix="handler")
+
+_chat_locks = {}     # {chat_id: [asyncio.Lock, сколько задач его ждут или держат]}
+_in_flight = set()   # фоновые задачи обработки апдейтов
+
+
+async def _process(update, chat_id):
+    # Замок чата живёт, пока у чата есть задачи, – словарь не растёт
+    # вместе с числом чатов
+    entry = _chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            await _handle(update, chat_id)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _chat_locks[chat_id]
+
+
+async def _handle(update, chat_id):
+    loop = asyncio.get_running_loop()
+    try:
+        # Загрузка тоже может упасть (раздел не скачался) – ответим как на ошибку
+        if chat_id is not None and chat_id not in tasks_by_user:
+            data = await load_data_async(chat_id)
+            tasks_by_user.setdefault(chat_id, data)
+        # Под замком пользователя (main.chat_lock), как и в main.py
+        await loop.run_in_executor(_pool, main.process_update, update, chat_id)
+    except Exception as e:
+        print(f"[asgi] update {update.update_id} failed: {e}")
+        if chat_id is not None:
+            await telegram_async.send_message(chat_id, "Что-то пошло не так, попробуйте ещё раз.")
+
+
+async def _webhook(body: bytes):
+    update = telebot.types.Update.de_json(body.decode("utf-8"))
+    chat_id, user_id = main.update_ids(update)
+
+    # Если пользователь не в белом списке — просто игнорируем апдейт
+    if user_id is not None and user_id not in main.ALLOWED_USERS:
+        return 200, "IGNORED"
+
+    task = asyncio.create_task(_process(update, chat_id))
+    _in_flight.add(task)
+    task.add_done_callback(_in_flight.discard)
+    return 200, "OK"
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await telegram_async.set_webhook(BASE_URL.rstrip("/") + "/webhook")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # Дожидаемся всех начатых апдейтов (Telegram их не повторит)
+            # и досливаем очередь сохранений
+            while _in_flight:
+                print(f"[asgi] waiting for {len(_in_flight)} updates in flight")
+                await asyncio.wait(set(_in_flight))
+            await asyncio.to_thread(write_behind.drain)
+            await telegram_async.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send, status, text):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+    })
+    await send({"type": "http.response.body", "body": text.encode("utf-8")})
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] == "/webhook" and scope["method"] == "POST":
+        body = await _read_body(receive)
+        try:
+            status, text = await _webhook(body)
+        except ValueError as e:
+            print(f"[asgi] bad update: {e}")
+            status, text = 400, "BAD REQUEST"
+    elif scope["path"] == "/" and scope["method"] == "GET":
+        status, text = 200, "ok"
+    else:
+        status, text = 404, "not found"
+    await _respond(send, status, text)
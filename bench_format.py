@@ -0,0 +1,86 @@
+"""
+Сравнение форматов файлов разделов на синтетических данных:
+
+    python bench_format.py              # разделы на 10 000 и 100 000 задач
+    python bench_format.py 50000        # свои размеры
+
+Для каждого формата (и со сжатием) – размер файла, время кодирования
+и время разбора в узлы (как при загрузке раздела). msgpack меряется той
+реализацией, которая доступна (пакет msgpack или встроенная, см.
+section_format.py), zstd – если установлен пакет zstandard.
+"""
+
+import random
+import sys
+import time
+
+import section_format
+from nodes import Node
+
+WORDS = (
+    "купить", "позвонить", "написать", "отчёт", "встреча", "молоко", "врач",
+    "проект", "письмо", "оплатить", "счёт", "подготовить", "презентацию",
+    "забрать", "посылку", "обсудить", "план", "квартал", "созвон", "команда",
+)
+
+
+def make_section(n, seed=1):
+    """Раздел из n задач: кириллица, у каждой пятой – подзадачи."""
+    rnd = random.Random(seed)
+    items = []
+    for i in range(1, n + 1):
+        item = Node(
+            " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 6))),
+            id=i,
+            done=rnd.random() < 0.3,
+            created_at=f"2026-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}T12:00:00",
+        )
+        if i % 5 == 0:
+            item.children = [{"title": rnd.choice(WORDS), "children": []} for _ in range(3)]
+        items.append(item)
+    return items
+
+
+def _best(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best, result
+
+
+def bench(n):
+    items = make_section(n)
+    variants = [
+        ("json indent=2", lambda: section_format.encode(items, "json", compress="")),
+        ("json compact", lambda: section_format.encode(items, "json", compact=True, compress="")),
+        ("msgpack", lambda: section_format.encode(items, "msgpack", compress="")),
+        ("json+zlib", lambda: section_format.encode(items, "json", compress="zlib")),
+        ("msgpack+zlib", lambda: section_format.encode(items, "msgpack", compress="zlib")),
+    ]
+    if section_format.zstandard is not None:
+        variants += [
+            ("json+zstd", lambda: section_format.encode(items, "json", compress="zstd")),
+            ("msgpack+zstd", lambda: section_format.encode(items, "msgpack", compress="zstd")),
+        ]
+    print(f"\n{n} задач:")
+    print(f"  {'формат':<15} {'размер, КБ':>11} {'запись, мс':>11} {'чтение, мс':>11}")
+    for name, encode in variants:
+        encode_time, body = _best(encode)
+        decode_time, decoded = _best(lambda: section_format.decode(body, Node.from_json))
+        assert len(decoded) == n
+        print(f"  {name:<15} {len(body) / 1024:>11.0f} {encode_time * 1000:>11.0f} {decode_time * 1000:>11.0f}")
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv] or [10_000, 100_000]
+    impl = "C (пакет msgpack)" if section_format.msgpack is not None else "встроенная на Python"
+    print(f"msgpack: {impl}")
+    for n in sizes:
+        bench(n)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
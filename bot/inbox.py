@@ -19,7 +19,9 @@ from storage import (
     complete_task_by_id,
     add_today_from_task,
     get_task_by_id,
+    section_version,
 )
+from render_cache import cached
 from bot.telegram_api import send_message
 
 
@@ -51,13 +53,19 @@ def parse_task_ids(text: str) -> Set[int]:
     return ids
 
 
-def render_inbox_text() -> Tuple[str, List[dict]]:
+def render_inbox_text(chat_id: int) -> Tuple[str, List[dict]]:
     """
     Produce a textual representation of the current inbox tasks and return
     a tuple (text, tasks) where text is the message to send and tasks is
     the underlying list of task dicts. Completed tasks are excluded.
+    The result is cached until the inbox section changes.
     """
-    tasks = list_active_tasks()
+    return cached("inbox", chat_id, "inbox", None, section_version(chat_id, "inbox"),
+                  lambda: _render_inbox_text(chat_id))
+
+
+def _render_inbox_text(chat_id: int) -> Tuple[str, List[dict]]:
+    tasks = list_active_tasks(user_id=chat_id)
     if not tasks:
         return "Твой инбокс пуст.\n\nИспользуй команду add <текст> для добавления задач.", tasks
     lines = ["Твой инбокс:"]
@@ -68,7 +76,7 @@ def render_inbox_text() -> Tuple[str, List[dict]]:
 
 def send_inbox(chat_id: int) -> None:
     """Send the current inbox to the specified chat."""
-    text, _ = render_inbox_text()
+    text, _ = render_inbox_text(chat_id)
     send_message(chat_id, text)
 
 
@@ -100,7 +108,7 @@ def handle_add_inbox_text(chat_id: int, text: str) -> None:
         return
     created: List[dict] = []
     for ln in lines:
-        task = add_task(ln)
+        task = add_task(ln, user_id=chat_id)
         created.append(task)
     if len(created) == 1:
         send_message(chat_id, f"Добавила задачу #{created[0]['id']}: {created[0]['text']}")
@@ -114,7 +122,7 @@ def handle_edit_task_text(chat_id: int, text: str, task_id: int) -> None:
     Update the text of a task. The caller must provide the task_id separately
     from the new text.
     """
-    success, updated = update_task_text(task_id, text)
+    success, updated = update_task_text(task_id, text, user_id=chat_id)
     if not success or updated is None:
         send_message(chat_id, "Не нашла эту задачу.")
         return
@@ -133,7 +141,7 @@ def handle_delete_tasks(chat_id: int, id_text: str) -> None:
         return
     deleted = 0
     for tid in ids:
-        if delete_task_by_id(tid):
+        if delete_task_by_id(tid, user_id=chat_id):
             deleted += 1
     send_message(chat_id, f"Удалено задач: {deleted}.")
     send_inbox(chat_id)
@@ -144,7 +152,7 @@ def handle_move_task(chat_id: int, task_id: int) -> None:
     Move a task into the today list. The task remains in the inbox but
     is also copied into today's list via add_today_from_task.
     """
-    item = add_today_from_task(task_id)
+    item = add_today_from_task(task_id, user_id=chat_id)
     if item:
         send_message(chat_id, f"Перенесла задачу #{task_id} в список 'Сегодня'.")
     else:
@@ -153,7 +161,7 @@ def handle_move_task(chat_id: int, task_id: int) -> None:
 
 def handle_open_task(chat_id: int, task_id: int) -> None:
     """Send a detailed card for the specified task."""
-    task = get_task_by_id(task_id)
+    task = get_task_by_id(task_id, user_id=chat_id)
     if task:
         send_message(chat_id, render_task_card(task))
     else:
@@ -3,11 +3,15 @@
 Карточка предмета (объект/класс).
 
 Используется для вещей: техника, аптечка, уход, расходники и т.п.
+Карточка – обычный узел списка (nodes.Node): название в title,
+остальные поля – в extra.
 """
 
 import datetime
 from typing import Optional
 
+from nodes import Node
+
 
 def new_item(
     *,
@@ -20,13 +24,13 @@ def new_item(
     usage_start: Optional[str] = None,       # Начало использования
     usage_expected_end: Optional[str] = None,# Предполагаемый конец
     reminder: bool = False                   # Нужно ли напомнить о покупке
-) -> dict:
+) -> Node:
     """
     Создаёт карточку предмета.
 
     Поля:
       id                    — уникальный ID
-      name                  — название предмета
+      name                  — название предмета (title узла)
       price                 — стоимость
       expected_usage_days   — планируемая длительность использования
       actual_usage_days     — фактическая длительность
@@ -36,56 +40,54 @@ def new_item(
       reminder              — True/False, нужно ли напоминать о покупке
     """
 
-    return {
-        "id": id,
-        "name": name,
-        "price": price,
-        "expected_usage_days": expected_usage_days,
-        "actual_usage_days": actual_usage_days,
-        "purchased_at": purchased_at,
-        "usage_start": usage_start,
-        "usage_expected_end": usage_expected_end,
-        "reminder": reminder,
-        "created_at": datetime.datetime.utcnow().isoformat(),
-    }
-
-
-def render_item_card(item: dict) -> str:
+    return Node(
+        name,
+        id=id,
+        created_at=datetime.datetime.utcnow().isoformat(),
+        extra={
+            "price": price,
+            "expected_usage_days": expected_usage_days,
+            "actual_usage_days": actual_usage_days,
+            "purchased_at": purchased_at,
+            "usage_start": usage_start,
+            "usage_expected_end": usage_expected_end,
+            "reminder": reminder,
+        },
+    )
+
+
+def render_item_card(item: Node) -> str:
     """
     Формирует красивый текст для карточки предмета (Telegram).
     """
 
     lines = []
-    lines.append(f"📦 Предмет #{item.get('id', '?')}")
-    lines.append(f"Название: {item.get('name', 'Без названия')}")
+    lines.append(f"📦 Предмет #{item.id or '?'}")
+    lines.append(f"Название: {item.title or 'Без названия'}")
 
     # Стоимость
-    if item.get("price") is not None:
-        lines.append(f"💰 Стоимость: {item['price']} €")
+    if item.price is not None:
+        lines.append(f"💰 Стоимость: {item.price} €")
 
     # Расчётное / фактическое время пользования
-    if item.get("expected_usage_days") is not None:
-        lines.append(f"⏳ План использования: ~{item['expected_usage_days']} дней")
+    if item.expected_usage_days is not None:
+        lines.append(f"⏳ План использования: ~{item.expected_usage_days} дней")
 
-    if item.get("actual_usage_days") is not None:
-        lines.append(f"📌 Факт использования: {item['actual_usage_days']} дней")
+    if item.actual_usage_days is not None:
+        lines.append(f"📌 Факт использования: {item.actual_usage_days} дней")
 
     # Даты
-    purchased = item.get("purchased_at")
-    if purchased:
-        lines.append(f"🛒 Куплено: {purchased}")
+    if item.purchased_at:
+        lines.append(f"🛒 Куплено: {item.purchased_at}")
 
-    start = item.get("usage_start")
-    if start:
-        lines.append(f"▶️ Начало использования: {start}")
+    if item.usage_start:
+        lines.append(f"▶️ Начало использования: {item.usage_start}")
 
-    end = item.get("usage_expected_end")
-    if end:
-        lines.append(f"🔚 Предполагаемый конец: {end}")
+    if item.usage_expected_end:
+        lines.append(f"🔚 Предполагаемый конец: {item.usage_expected_end}")
 
     # Напоминание
-    reminder = item.get("reminder")
-    if reminder:
+    if item.reminder:
         lines.append("🔔 Напоминание: включено")
     else:
         lines.append("🔔 Напоминание: выключено")
@@ -4,11 +4,15 @@
 
 Это НЕ обычная "рутина" из списка,
 а более детальная штука для работы с одной конкретной рутиной.
+Карточка – узел списка (nodes.Node): название в title, комментарий
+в comment, остальные поля – в extra.
 """
 
 from typing import List, Optional
 import datetime
 
+from nodes import Node
+
 
 def new_routine_task(
     *,
@@ -24,9 +28,9 @@ def new_routine_task(
     start_time: Optional[str] = None,
     end_time: Optional[str] = None,
     reminder: bool = False,
-) -> dict:
+) -> Node:
     """
-    Создаёт словарь с полной карточкой задачи-рутины.
+    Создаёт узел с полной карточкой задачи-рутины.
 
     Поля:
       id               — внутренний id (можно брать из счётчика)
@@ -43,24 +47,26 @@ def new_routine_task(
       reminder         — нужно ли напоминание (True/False)
     """
 
-    return {
-        "id": id,
-        "name": name,
-        "description": description,
-        "steps": steps or [],
-        "components": components or [],
-        "planned_minutes": planned_minutes,
-        "actual_minutes": actual_minutes,
-        "comment": comment,
-        "repeat": repeat,
-        "start_time": start_time,
-        "end_time": end_time,
-        "reminder": reminder,
-        "created_at": datetime.datetime.utcnow().isoformat(),
-    }
-
-
-def render_routine_task_card(rt: dict) -> str:
+    return Node(
+        name,
+        id=id,
+        comment=comment,
+        created_at=datetime.datetime.utcnow().isoformat(),
+        extra={
+            "description": description,
+            "steps": steps or [],
+            "components": components or [],
+            "planned_minutes": planned_minutes,
+            "actual_minutes": actual_minutes,
+            "repeat": repeat,
+            "start_time": start_time,
+            "end_time": end_time,
+            "reminder": reminder,
+        },
+    )
+
+
+def render_routine_task_card(rt: Node) -> str:
     """
     Красиво выводит карточку задачи-рутины в текстовом виде
     (для отправки в Telegram).
@@ -69,19 +75,19 @@ def render_routine_task_card(rt: dict) -> str:
     lines: List[str] = []
 
     # Заголовок
-    lines.append(f"🔁 Рутина-задача #{rt.get('id', '?')}")
+    lines.append(f"🔁 Рутина-задача #{rt.id or '?'}")
     lines.append("")
-    lines.append(f"Название: {rt.get('name', 'Без названия')}")
+    lines.append(f"Название: {rt.title or 'Без названия'}")
 
     # Описание
-    desc = (rt.get("description") or "").strip()
+    desc = (rt.description or "").strip()
     if desc:
         lines.append("")
         lines.append("Описание:")
         lines.append(desc)
 
     # Шаги
-    steps = rt.get("steps") or []
+    steps = rt.steps or []
     if steps:
         lines.append("")
         lines.append("Шаги:")
@@ -89,7 +95,7 @@ def render_routine_task_card(rt: dict) -> str:
             lines.append(f"{i}. {s}")
 
     # Компоненты / предметы
-    comps = rt.get("components") or []
+    comps = rt.components or []
     if comps:
         lines.append("")
         lines.append("Что понадобится:")
@@ -97,10 +103,10 @@ def render_routine_task_card(rt: dict) -> str:
             lines.append(f"• {c}")
 
     # Время
-    planned = rt.get("planned_minutes")
-    actual = rt.get("actual_minutes")
-    start_time = rt.get("start_time")
-    end_time = rt.get("end_time")
+    planned = rt.planned_minutes
+    actual = rt.actual_minutes
+    start_time = rt.start_time
+    end_time = rt.end_time
 
     time_lines = []
     if planned is not None:
@@ -119,19 +125,19 @@ def render_routine_task_card(rt: dict) -> str:
             lines.append(f"- {t}")
 
     # Повторяемость
-    repeat = (rt.get("repeat") or "").strip()
+    repeat = (rt.repeat or "").strip()
     if repeat:
         lines.append("")
         lines.append(f"🔁 Повторяемость: {repeat}")
 
     # Напоминание
-    if rt.get("reminder"):
+    if rt.reminder:
         lines.append("🔔 Напоминание: включено")
     else:
         lines.append("🔔 Напоминание: выключено")
 
     # Комментарий
-    comment = (rt.get("comment") or "").strip()
+    comment = (rt.comment or "").strip()
     if comment:
         lines.append("")
         lines.append("Комментарий:")
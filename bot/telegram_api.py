@@ -1,6 +1,11 @@
 # bot/telegram_api.py
 import os
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 if not TOKEN:
@@ -8,14 +13,80 @@ if not TOKEN:
 
 API_URL = f"https://api.telegram.org/bot{TOKEN}/"
 
+# Общая сессия с пулом keep-alive соединений к api.telegram.org:
+# TCP+TLS рукопожатие платим один раз, а не на каждый запрос.
+POOL_SIZE = int(os.getenv("TG_POOL_SIZE", "10"))
+# Повторы при 429 и 5xx: сколько раз, начальная пауза (с) и потолок паузы (с).
+# Сетевые ошибки повторяем, только если соединиться не удалось и запрос
+# точно не ушёл (см. _not_sent). После ReadTimeout или обрыва уже открытого
+# соединения ("Connection aborted") Telegram мог его выполнить, и повтор
+# sendMessage прислал бы сообщение дважды.
+MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+RETRY_BACKOFF = float(os.getenv("TG_RETRY_BACKOFF", "0.5"))
+MAX_RETRY_WAIT = float(os.getenv("TG_MAX_RETRY_WAIT", "30"))
+
+_session = None
+_session_lock = threading.Lock()
+
 
-def tg_request(method: str, payload: dict):
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def _retry_after(r) -> float:
+    """Сколько ждать перед повтором: Telegram присылает parameters.retry_after при 429."""
     try:
-        r = requests.post(API_URL + method, json=payload, timeout=5)
-        return r.json()
-    except Exception as e:
-        print("Telegram API error:", e)
-        return None
+        return float(r.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return 0.0
+
+
+def _not_sent(err) -> bool:
+    """
+    True, если запрос не ушёл: не дождались соединения (ConnectTimeout)
+    или не смогли его открыть (NewConnectionError, в том числе DNS).
+    Прочие ConnectionError – обрыв после отправки, их не повторяем.
+    """
+    if isinstance(err, requests.ConnectTimeout):
+        return True
+    reason = getattr(err.args[0], "reason", None) if err.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def tg_request(method: str, payload: dict, timeout: float = 5):
+    delay = RETRY_BACKOFF
+    for attempt in range(MAX_RETRIES + 1):
+        last_attempt = attempt == MAX_RETRIES
+        try:
+            r = _get_session().post(API_URL + method, json=payload, timeout=timeout)
+        except requests.RequestException as e:
+            print("Telegram API error:", e)
+            if last_attempt or not _not_sent(e):
+                return None
+            time.sleep(delay)
+            delay *= 2
+            continue
+
+        if (r.status_code == 429 or r.status_code >= 500) and not last_attempt:
+            wait = min(_retry_after(r) or delay, MAX_RETRY_WAIT)
+            print(f"Telegram API {r.status_code} on {method}, retry in {wait:.1f} s")
+            time.sleep(wait)
+            delay *= 2
+            continue
+
+        try:
+            return r.json()
+        except ValueError as e:
+            print("Telegram API error:", e)
+            return None
 
 
 def send_message(chat_id, text, reply_markup=None, parse_mode=None):
@@ -0,0 +1,74 @@
+# bot/telegram_async.py
+"""
+Асинхронный клиент Telegram Bot API (aiohttp) – пара к bot/telegram_api.py
+для asyncio-кода (asgi.py). Та же логика: одна сессия с пулом соединений,
+повторы при 429/5xx с учётом retry_after и при неудачном соединении.
+"""
+import asyncio
+
+import aiohttp
+
+from bot.telegram_api import API_URL, POOL_SIZE, MAX_RETRIES, RETRY_BACKOFF, MAX_RETRY_WAIT
+
+_session = None
+
+
+def _get_session() -> aiohttp.ClientSession:
+    # Сессия живёт в цикле событий asgi.py; создаём при первом запросе
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(total=5),
+        )
+    return _session
+
+
+async def close():
+    """Закрыть сессию (при остановке приложения)."""
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+
+async def tg_request(method: str, payload: dict):
+    delay = RETRY_BACKOFF
+    for attempt in range(MAX_RETRIES + 1):
+        last_attempt = attempt == MAX_RETRIES
+        try:
+            async with _get_session().post(API_URL + method, json=payload) as r:
+                data = await r.json(content_type=None)
+                status = r.status
+        except aiohttp.ClientConnectorError as e:
+            # Соединиться не удалось – запрос не ушёл, повторять безопасно
+            print("Telegram API error:", e)
+            if last_attempt:
+                return None
+            await asyncio.sleep(delay)
+            delay *= 2
+            continue
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            # Запрос мог уже выполниться (как с ReadTimeout в telegram_api.py)
+            print("Telegram API error:", e)
+            return None
+
+        if (status == 429 or status >= 500) and not last_attempt:
+            retry_after = (data or {}).get("parameters", {}).get("retry_after") or delay
+            wait = min(float(retry_after), MAX_RETRY_WAIT)
+            print(f"Telegram API {status} on {method}, retry in {wait:.1f} s")
+            await asyncio.sleep(wait)
+            delay *= 2
+            continue
+        return data
+
+
+async def send_message(chat_id, text, reply_markup=None, parse_mode=None):
+    payload = {"chat_id": chat_id, "text": text}
+    if reply_markup is not None:
+        payload["reply_markup"] = reply_markup
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    return await tg_request("sendMessage", payload)
+
+
+async def set_webhook(url):
+    return await tg_request("setWebhook", {"url": url})
@@ -1,10 +1,18 @@
 from bot.keyboards import today_inline_keyboard
 from bot.telegram_api import send_message, edit_message
-from storage import list_today, get_task_by_id
+from storage import list_today, get_task_by_id, section_version
+from render_cache import cached
 
 
-def render_today_text():
-    items = list_today()
+def render_today_text(chat_id):
+    # Список "Сегодня" показывает текст и отметки задач инбокса –
+    # кэш годен, пока не менялся ни один из двух разделов
+    version = (section_version(chat_id, "today"), section_version(chat_id, "inbox"))
+    return cached("today", chat_id, "today", None, version, lambda: _render_today_text(chat_id))
+
+
+def _render_today_text(chat_id):
+    items = list_today(user_id=chat_id)
     buttons_tasks = []
 
     if not items:
@@ -19,7 +27,7 @@ def render_today_text():
         task_id = it.get("task_id")
         if not task_id:
             continue
-        task = get_task_by_id(task_id)
+        task = get_task_by_id(task_id, user_id=chat_id)
         if not task:
             continue
 
@@ -36,13 +44,13 @@ def render_today_text():
 
 
 def send_today(chat_id):
-    text, buttons_tasks = render_today_text()
+    text, buttons_tasks = render_today_text(chat_id)
     kb = today_inline_keyboard(buttons_tasks)
     send_message(chat_id, text, reply_markup=kb)
 
 
 def refresh_today(chat_id, message_id):
-    text, buttons_tasks = render_today_text()
+    text, buttons_tasks = render_today_text(chat_id)
     kb = today_inline_keyboard(buttons_tasks)
     try:
         edit_message(chat_id, message_id, text, reply_markup=kb)
@@ -0,0 +1,96 @@
+"""
+Ограниченный кэш в памяти: LRU + время жизни записи (TTL).
+
+Используется для контекста списков в main.py (context_map), чтобы память
+долгоживущего воркера не росла без конца. Потокобезопасный, считает
+попадания, промахи и вытеснения.
+
+VersionedCache поверх него хранит вместе со значением версию данных,
+из которых оно получено (см. render_cache.py).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Не больше maxsize записей; запись старше ttl секунд считается
+    отсутствующей. При переполнении вытесняется давно не использованная.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # {key: (expires_at, value)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.evictions += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (now + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class VersionedCache:
+    """
+    TTLCache, где значение годно только для своей версии данных:
+    get_or_build(key, version, build) отдаёт сохранённое значение, если
+    версия совпала, иначе строит новое через build() и заменяет им старое.
+    Устаревшие записи не копятся – на ключ всегда одна запись.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize, ttl)
+        self.stale = 0
+
+    def get_or_build(self, key, version, build):
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        if entry is not None:
+            self.stale += 1
+        value = build()
+        self._cache.set(key, (version, value))
+        return value
+
+    def __len__(self):
+        return len(self._cache)
+
+    def stats(self) -> dict:
+        return dict(self._cache.stats(), stale=self.stale)
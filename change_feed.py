@@ -0,0 +1,114 @@
+"""
+Слежение за изменениями в Dropbox (STORAGE_WATCH=1).
+
+tasks_by_user заполняется один раз, поэтому правки файлов мимо бота
+(приложение Dropbox, другой воркер) без слежения не видны до рестарта,
+а потом затираются очередным сохранением.
+
+Фоновый поток держит курсор list_folder на всю папку FOLDER (рекурсивно)
+и ждёт изменений через list_folder_longpoll: запрос висит до
+STORAGE_WATCH_TIMEOUT секунд и возвращается, как только в папке что-то
+поменялось, – без опроса по таймеру. Изменившиеся файлы забираются
+list_folder/continue, а storage.apply_remote_changes перечитывает только
+затронутые разделы пользователей, уже загруженных в память. Свои заливки
+узнаются по rev и не перечитываются; раздел с несохранёнными правками
+не трогаем (см. storage._reload_remote_files).
+
+Если Dropbox сбросил курсор (или его не удалось получить), берём новый
+и сверяем ревизии файлов загруженных пользователей (storage.resync_remote).
+"""
+
+import os
+import threading
+import time
+
+from dropbox.exceptions import ApiError
+from dropbox.files import FileMetadata, DeletedMetadata
+
+import storage
+
+WATCH = os.environ.get("STORAGE_WATCH", "0") == "1"
+WATCH_TIMEOUT = int(os.environ.get("STORAGE_WATCH_TIMEOUT", "120"))  # 30..480 (пределы Dropbox), секунды
+WATCH_ERROR_DELAY = 10  # пауза после ошибки, секунды
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def start():
+    """Запустить поток слежения (один на процесс). Без STORAGE_WATCH или не с Dropbox – ничего."""
+    global _thread
+    if not WATCH or storage.STORAGE_BACKEND != "dropbox":
+        return
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="change-feed", daemon=True)
+            _thread.start()
+
+
+def _latest_cursor():
+    res = storage._dbx().files_list_folder_get_latest_cursor(storage.FOLDER.rstrip("/"), recursive=True)
+    return res.cursor
+
+
+def _changes(cursor):
+    """(изменения [(путь, rev или None – файл удалён)], новый курсор)."""
+    changes = []
+    while True:
+        res = storage._dbx().files_list_folder_continue(cursor)
+        for entry in res.entries:
+            if isinstance(entry, FileMetadata):
+                changes.append((entry.path_lower, entry.rev))
+            elif isinstance(entry, DeletedMetadata):
+                changes.append((entry.path_lower, None))
+        cursor = res.cursor
+        if not res.has_more:
+            return changes, cursor
+
+
+def _is_reset(err: ApiError) -> bool:
+    """True, если Dropbox сбросил курсор и его надо получить заново."""
+    error = getattr(err, "error", None)
+    try:
+        return error.is_reset()
+    except AttributeError:
+        return False
+
+
+def poll_once(cursor):
+    """
+    Дождаться изменений (long-poll) и применить их.
+    Возвращает курсор для следующего вызова.
+    """
+    result = storage._dbx().files_list_folder_longpoll(cursor, timeout=WATCH_TIMEOUT)
+    if result.changes:
+        changes, cursor = _changes(cursor)
+        replaced = storage.apply_remote_changes(changes)
+        if replaced:
+            print(f"[change_feed] reloaded {replaced} sections")
+    if result.backoff:
+        # Dropbox просит не спрашивать чаще
+        time.sleep(result.backoff)
+    return cursor
+
+
+def _run():
+    cursor = None
+    while True:
+        try:
+            if cursor is None:
+                cursor = _latest_cursor()
+                # Что поменялось, пока курсора не было, – сверяем по ревизиям
+                storage.resync_remote()
+                print(f"[change_feed] watching {storage.FOLDER or '/'}")
+            cursor = poll_once(cursor)
+        except ApiError as e:
+            if _is_reset(e):
+                print("[change_feed] cursor reset, resyncing")
+            else:
+                print(f"[change_feed] Dropbox error: {e}")
+                time.sleep(WATCH_ERROR_DELAY)
+            cursor = None
+        except Exception as e:
+            print(f"[change_feed] error: {e}")
+            time.sleep(WATCH_ERROR_DELAY)
@@ -0,0 +1,151 @@
+"""
+Локальный кэш файлов Dropbox на диске (STORAGE_CACHE_DIR).
+
+Файл лежит по тому же пути, что и в Dropbox, внутри каталога кэша, а рядом
+в "<файл>.rev" – ревизия Dropbox, с которой он совпадает. storage при
+загрузке одним запросом list_folder узнаёт ревизии всех файлов папки
+пользователя и качает только те, чья ревизия разошлась с кэшем (см.
+storage._download_json), а свои заливки сразу кладёт в кэш – так рестарт
+без изменений в Dropbox читает разделы с диска.
+
+Запись атомарная: сначала во временный файл, потом os.replace, и .rev
+пишется последним – оборванная запись не выдаст старые данные за новые.
+"""
+
+import os
+import threading
+import uuid
+
+CACHE_DIR = os.environ.get("STORAGE_CACHE_DIR", "")
+ENABLED = bool(CACHE_DIR)
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def _local(path: str) -> str:
+    return os.path.join(CACHE_DIR, path.lstrip("/"))
+
+
+def _tmp_name(local: str) -> str:
+    return f"{local}.{uuid.uuid4().hex}.tmp"
+
+
+def get(path: str, rev: str):
+    """Куски закэшированного файла, если он совпадает с ревизией rev, иначе None."""
+    local = _local(path)
+    try:
+        with open(local + ".rev", encoding="utf-8") as f:
+            if f.read() != rev:
+                return None
+        f = open(local, "rb")
+    except OSError:
+        return None
+    return _read_chunks(f)
+
+
+def _read_chunks(f):
+    with f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _commit(local: str, tmp: str, rev: str):
+    # Старую ревизию убираем до подмены файла: если процесс упадёт
+    # посередине, кэш окажется просто недействительным
+    try:
+        os.remove(local + ".rev")
+    except FileNotFoundError:
+        pass
+    os.replace(tmp, local)
+    rev_tmp = _tmp_name(local)
+    with open(rev_tmp, "w", encoding="utf-8") as f:
+        f.write(rev)
+    os.replace(rev_tmp, local + ".rev")
+
+
+def put(path: str, rev: str, body: bytes):
+    """Положить файл в кэш (ошибки диска не мешают работе – только пишем в лог)."""
+    local = _local(path)
+    tmp = _tmp_name(local)
+    try:
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(body)
+        _commit(local, tmp, rev)
+    except OSError as e:
+        print(f"[disk_cache] write error for {path}: {e}")
+        _discard(tmp)
+
+
+def _discard(tmp):
+    try:
+        os.remove(tmp)
+    except OSError:
+        pass
+
+
+class Tee:
+    """
+    Пропускает куски файла насквозь и параллельно пишет их во временный
+    файл; commit(rev) дочитывает остаток и кладёт файл в кэш – только если
+    все куски прошли (иначе временный файл просто удаляется).
+    """
+
+    def __init__(self, path: str, chunks):
+        self._path = path
+        self._local = _local(path)
+        self._chunks = iter(chunks)
+        self._tmp = _tmp_name(self._local)
+        self._file = None
+        self._done = False
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(os.path.dirname(self._local), exist_ok=True)
+            self._file = open(self._tmp, "wb")
+        except OSError as e:
+            print(f"[disk_cache] write error for {path}: {e}")
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._done = True
+            raise
+        if self._file is not None:
+            try:
+                self._file.write(chunk)
+            except OSError as e:
+                print(f"[disk_cache] write error for {self._path}: {e}")
+                self._close(keep=False)
+        return chunk
+
+    def _close(self, keep):
+        with self._lock:
+            if self._file is None:
+                return False
+            self._file.close()
+            self._file = None
+        if not keep:
+            _discard(self._tmp)
+        return keep
+
+    def commit(self, rev: str):
+        for _ in self:
+            pass
+        if not self._close(keep=self._done):
+            return
+        try:
+            _commit(self._local, self._tmp, rev)
+        except OSError as e:
+            print(f"[disk_cache] write error for {self._path}: {e}")
+            _discard(self._tmp)
+
+    def discard(self):
+        """Не класть в кэш (заливка/разбор не удались)."""
+        self._close(keep=False)
@@ -0,0 +1,135 @@
+"""
+Потоковый JSON для файлов разделов.
+
+Чтение: JSON-массив разбирается по мере прихода кусков ответа – элемент
+за элементом (load), так что в памяти нет ни всего тела ответа, ни всей
+строки документа рядом с разобранными элементами. Каждый элемент сразу
+можно превратить в узел (item_hook=Node.from_json). Документ другого вида
+(объект, как contexts.json) собирается целиком и читается json.loads.
+
+Запись: encode_chunks выдаёт документ кусками байтов заданного размера
+(json.JSONEncoder.iterencode), storage заливает их сессией загрузки
+Dropbox. Формат – с отступами, как раньше, или компактный (compact=True).
+"""
+
+import codecs
+import itertools
+import json
+import re
+
+from nodes import json_default
+
+# Кусок для заливки (Dropbox считает content_hash блоками по 4 МБ)
+# и для чтения ответа
+CHUNK_SIZE = 4 * 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+_WS = " \t\n\r"
+_AFTER_ITEM = _WS + ",]"
+_skip_ws = re.compile(r"[ \t\n\r]*").match
+_decoder = json.JSONDecoder()
+
+
+def encode_chunks(obj, compact=False, chunk_size=CHUNK_SIZE):
+    """JSON-документ obj кусками байтов по chunk_size (последний – короче)."""
+    if compact:
+        encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=json_default)
+    else:
+        encoder = json.JSONEncoder(ensure_ascii=False, indent=2, default=json_default)
+    buf = bytearray()
+    for piece in encoder.iterencode(obj):
+        buf += piece.encode("utf-8")
+        while len(buf) >= chunk_size:
+            yield bytes(buf[:chunk_size])
+            del buf[:chunk_size]
+    if buf:
+        yield bytes(buf)
+
+
+def _text(chunks):
+    """Куски байтов -> куски строки (UTF-8 может разрываться между кусками)."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def load(chunks, item_hook=None):
+    """
+    Разобрать JSON из кусков байтов. Для массива – список элементов,
+    пропущенных через item_hook (если задан); иначе – как json.loads.
+    """
+    pieces = _text(chunks)
+    buf = ""
+    for piece in pieces:
+        buf += piece
+        if buf.lstrip(_WS):
+            break
+    start = len(buf) - len(buf.lstrip(_WS))
+    if not buf[start:start + 1] == "[":
+        # Не массив – читаем целиком
+        return json.loads(buf + "".join(pieces))
+    return list(_iter_array(buf, start + 1, pieces, item_hook))
+
+
+def _iter_array(buf, pos, pieces, item_hook):
+    exhausted = False
+    expect_item = True  # после "[" или "," ждём элемент (или "]" сразу после "[")
+    first = True
+    while True:
+        # Пропускаем пробелы и разделитель
+        while True:
+            pos = _skip_ws(buf, pos).end()
+            if pos < len(buf):
+                break
+            buf, pos = "", 0
+            piece = next(pieces, None)
+            if piece is None:
+                raise ValueError("unexpected end of JSON array")
+            buf = piece
+        ch = buf[pos]
+        if ch == "]" and (first or not expect_item):
+            _check_tail(buf, pos + 1, pieces)
+            return
+        if not expect_item:
+            if ch != ",":
+                raise ValueError(f"expected ',' or ']' in JSON array, got {ch!r}")
+            pos += 1
+            expect_item = True
+            continue
+        # Элемент: разбираем, когда он целиком в буфере. Число на конце
+        # буфера ("12" или "1.5" перед "e3") ещё может продолжиться, поэтому
+        # элемент принимаем, только когда за ним виден разделитель.
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buf, pos)
+                if exhausted or (end < len(buf) and buf[end] in _AFTER_ITEM):
+                    break
+            except ValueError:
+                if exhausted:
+                    raise
+            piece = next(pieces, None)
+            if piece is None:
+                exhausted = True
+            else:
+                buf = buf[pos:] + piece
+                pos = 0
+        yield item_hook(value) if item_hook else value
+        pos = end
+        expect_item = False
+        first = False
+
+
+def _check_tail(buf, pos, pieces):
+    """
+    После закрывающей "]" дочитываем вход до конца: там могут быть только
+    пробелы. Заодно доходит до конца и распаковка (section_format
+    проверяет, что сжатый поток не оборван).
+    """
+    for tail in itertools.chain([buf[pos:]], pieces):
+        if tail.strip(_WS):
+            raise ValueError("extra data after JSON array")
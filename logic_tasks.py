@@ -1,5 +1,6 @@
 import re
 import storage
+from paging import PAGE_SIZE, window
 
 # Тексты меню
 MENU_INBOX = "Инбокс"
@@ -169,10 +170,16 @@ def handle_today_screen():
 
 # ---------- inbox ----------
 
-def handle_inbox():
-    tasks = storage.list_active_tasks()
-    if not tasks:
+def handle_inbox(page: int = 0):
+    # Кнопки – только для задач видимой страницы, плюс строка листания
+    start = page * PAGE_SIZE
+    tasks, total = storage.active_tasks_page(start, start + PAGE_SIZE)
+    if not total:
         return {"text": "В инбоксе пусто ✨"}
+    page, pages, start, end = window(total, page)
+    if not tasks:
+        # Страница исчезла (задачи удалили) – показываем последнюю
+        tasks, total = storage.active_tasks_page(start, end)
 
     items = []
     for t in tasks:
@@ -187,6 +194,14 @@ def handle_inbox():
             ],
         })
 
+    if pages > 1:
+        nav = []
+        if page > 0:
+            nav.append({"text": "◀", "callback": f"inbox_page:{page - 1}"})
+        if page < pages - 1:
+            nav.append({"text": "▶", "callback": f"inbox_page:{page + 1}"})
+        items.append({"text": f"Стр. {page + 1}/{pages} (задач: {total})", "buttons": nav})
+
     return {"multiple": True, "items": items}
 
 
@@ -376,7 +391,11 @@ def handle_command(text: str):
 # ---------- callback-кнопки ----------
 
 def handle_callback(data: str):
-    # done:id, edit:id, del:id, today:id, proj:id
+    # done:id, edit:id, del:id, today:id, proj:id, inbox_page:N
+    if data.startswith("inbox_page:"):
+        page = data.split(":", 1)[1]
+        return handle_inbox(int(page) if page.isdigit() else 0)
+
     if data.startswith("done:"):
         task_id = int(data.split(":", 1)[1])
         ok, task = storage.complete_task_by_id(task_id)
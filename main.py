@@ -1,9 +1,16 @@
 import os
+import threading
 import telebot
 from auth_config import is_allowed
 from telebot import types        # ← ДОБАВЬ ЭТУ СТРОКУ
 from flask import Flask, request
-from storage import tasks_by_user, save_data, load_data
+from storage import tasks_by_user, load_data, save_data, record_op, user_lock, UserData, CONTEXT_TTL
+from write_behind import schedule_save
+from mutations import apply as apply_op
+from cache import TTLCache
+from render_cache import cached, render_cache
+from paging import window
+import change_feed
 # import keyboards  # (клавиатура меню удалена, более не используется)
 def main_keyboard():
     kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -15,10 +22,16 @@ def main_keyboard():
 
 
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
-bot = telebot.TeleBot(TOKEN)
+# Хендлеры выполняются прямо в потоке запроса (threaded=False), а не в пуле
+# telebot: только так замок чата в process_update действительно держится
+# на всё время обработки апдейта.
+bot = telebot.TeleBot(TOKEN, threaded=False)
 
 app = Flask(__name__)
 
+# Правки файлов в Dropbox мимо бота подхватываются в фоне (STORAGE_WATCH=1)
+change_feed.start()
+
 #🔒 Разрешённые пользователи
 ALLOWED_USERS = {7604757170}  # <-- сюда вместо 123456789 вставь свой ID
 
@@ -30,79 +43,252 @@ def is_allowed(message):
     user_id = message.from_user.id if message.from_user else None
     return user_id in ALLOWED_USERS
 
-# Глобальные структуры для контекста и истории действий (для undo)
-context_map = {}  # {(chat_id, message_id): (section, parent_index)}
-undo_stack = {}   # {chat_id: [actions...]}
+# Контекст отправленных списков: какой раздел/элемент показан в сообщении.
+# В памяти – ограниченный кэш (LRU + время жизни), а сохраняется контекст
+# вместе с данными пользователя (user_data.contexts), так что ответы на списки
+# работают и после рестарта.
+# (история действий для undo тоже хранится в данных пользователя: user_data.undo)
+CONTEXT_MAX = int(os.environ.get("CONTEXT_MAX", "5000"))
+context_map = TTLCache(maxsize=CONTEXT_MAX, ttl=CONTEXT_TTL)  # {ключ сообщения: (section, parent_index)}
+
+
+def _context_key(chat_id, message_id):
+    """Ключ сообщения одним числом: message_id внутри чата меньше 2**32."""
+    return (chat_id << 32) | message_id
+
+
+def get_context(chat_id, message_id):
+    """(section, parent_index) списка в сообщении или None."""
+    key = _context_key(chat_id, message_id)
+    ctx = context_map.get(key)
+    if ctx is None:
+        # Не в памяти (например, после рестарта) – смотрим сохранённый контекст
+        ctx = get_user_data(chat_id).get_context(message_id)
+        if ctx is not None:
+            context_map.set(key, ctx)
+    return ctx
+
+
+def remember_context(chat_id, message_id, section, parent_index):
+    context_map.set(_context_key(chat_id, message_id), (section, parent_index))
+    user_data = get_user_data(chat_id)
+    user_data.remember_context(message_id, section, parent_index)
+    # Отдельной заливки контекст не стоит: уйдёт с ближайшим сохранением
+    # данных, а без правок – по долгому таймеру (write_behind.CONTEXT_FLUSH_MS)
+    schedule_save(chat_id, user_data, low_priority=True)
+
+# Правка списка на месте: после /add, /edit, /mv, /del и /undo ответом на
+# список бот правит это же сообщение (editMessageText), а не шлёт новое.
+# Если текст не изменился, запроса нет вовсе. LIST_EDIT_IN_PLACE=0 – старое
+# поведение (каждый раз новое сообщение).
+EDIT_IN_PLACE = os.environ.get("LIST_EDIT_IN_PLACE", "1") == "1"
+# Последний показанный текст списка и его страница – (text, page) по ключу
+# сообщения (как у context_map)
+list_texts = TTLCache(maxsize=CONTEXT_MAX, ttl=CONTEXT_TTL)
 
 # Список допустимых разделов для /open и назначения перемещения
 SECTIONS = {"inbox", "today", "routines", "templates", "projects", "habits", "sos"}
 
+# ====== ОТВЕТЫ И ПАЧКИ АПДЕЙТОВ ======
+#
+# Хендлеры отвечают через reply(). Обычно это просто bot.send_message, но при
+# разборе пачки апдейтов одного чата (process_batch, polling.py) ответы копятся:
+# простые сообщения склеиваются в одно, каждый список показывается один раз
+# после всех изменений, а данные сохраняются одним разом.
+
+MAX_MESSAGE_LEN = 4096  # предел Telegram на длину сообщения
+
+_local = threading.local()
+
+
+class UpdateBatch:
+    """Состояние пачки апдейтов одного чата (живёт в потоке, который её разбирает)."""
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.replies = []   # [(text, kwargs)] – отложенные ответы по порядку
+        self.sections = {}  # {(section, parent_index): message_id или None} – списки для показа
+        self.save = False   # были изменения – сохранить в конце
+        self.flushing = False
+
+
+def _batch(chat_id):
+    """Пачка, которую сейчас разбирает этот поток для chat_id, или None."""
+    batch = getattr(_local, "batch", None)
+    return batch if batch is not None and batch.chat_id == chat_id else None
+
+
+def reply(chat_id, text, **kwargs):
+    """Ответить в чат (в пачке апдейтов – отложить до её конца)."""
+    batch = _batch(chat_id)
+    if batch is not None and not batch.flushing:
+        batch.replies.append((text, kwargs))
+        return None
+    return bot.send_message(chat_id, text, **kwargs)
+
+
+def _send_replies(batch):
+    """Отправить отложенные ответы, склеив подряд идущие простые сообщения."""
+    merged = []  # [[текст, kwargs]]
+    for text, kwargs in batch.replies:
+        last = merged[-1] if merged else None
+        if (last is not None and not kwargs.get("reply_markup") and last[1] == kwargs
+                and len(last[0]) + 1 + len(text) <= MAX_MESSAGE_LEN):
+            last[0] += "\n" + text
+        else:
+            merged.append([text, kwargs])
+    for text, kwargs in merged:
+        try:
+            bot.send_message(batch.chat_id, text, **kwargs)
+        except Exception as e:
+            # Изменения уже сохранены – одна неотправленная реплика не мешает остальным
+            print(f"[batch] reply failed for chat {batch.chat_id}: {e}")
+
+
 def get_user_data(chat_id):
     """Получить (или инициализировать) хранилище задач для пользователя."""
     if chat_id not in tasks_by_user:
-        tasks_by_user[chat_id] = load_data(chat_id)  # загрузить из файла или создать новые
-        if tasks_by_user[chat_id] is None:
-            # Инициализация с шаблонами по умолчанию, если нет сохраненных данных
-            tasks_by_user[chat_id] = {
-                "inbox": [],
-                "today": [],
-                "routines": [ {"title": "Пример утренней рутины", "children": [
-                                    {"title": "Проснуться", "children": []},
-                                    {"title": "Сделать зарядку", "children": []},
-                                    {"title": "Позавтракать", "children": []}
-                               ]} ],
-                "templates": [ {"title": "Пример плана дня", "children": [
-                                    {"title": "Утренние задачи", "children": []},
-                                    {"title": "Дневные задачи", "children": []},
-                                    {"title": "Вечерние задачи", "children": []}
-                               ]},
-                               {"title": "Шаблон SOS", "children": [
-                                    {"title": "Пауза и глубокий вдох", "children": []},
-                                    {"title": "Определить приоритетную задачу", "children": []},
-                                    {"title": "Начать с малого шага", "children": []}
-                               ]} ],
-                "projects": [],
-                "habits": [],
-                "sos": []
-            }
+        # Замок пользователя: два апдейта одного чата не загрузят данные дважды,
+        # а другие пользователи его не ждут
+        with user_lock(chat_id):
+            if chat_id in tasks_by_user:
+                return tasks_by_user[chat_id]
+            # Разделы подгружаются при первом обращении (storage.LAZY_LOAD),
+            # так что первый ответ ждёт только нужный раздел
+            tasks_by_user[chat_id] = load_data(chat_id)  # загрузить из файла или создать новые
+            if tasks_by_user[chat_id] is None:
+                # Инициализация с шаблонами по умолчанию, если нет сохраненных данных
+                tasks_by_user[chat_id] = UserData({
+                    "inbox": [],
+                    "today": [],
+                    "routines": [ {"title": "Пример утренней рутины", "children": [
+                                        {"title": "Проснуться", "children": []},
+                                        {"title": "Сделать зарядку", "children": []},
+                                        {"title": "Позавтракать", "children": []}
+                                   ]} ],
+                    "templates": [ {"title": "Пример плана дня", "children": [
+                                        {"title": "Утренние задачи", "children": []},
+                                        {"title": "Дневные задачи", "children": []},
+                                        {"title": "Вечерние задачи", "children": []}
+                                   ]},
+                                   {"title": "Шаблон SOS", "children": [
+                                        {"title": "Пауза и глубокий вдох", "children": []},
+                                        {"title": "Определить приоритетную задачу", "children": []},
+                                        {"title": "Начать с малого шага", "children": []}
+                                   ]} ],
+                    "projects": [],
+                    "habits": [],
+                    "sos": []
+                })
+                # Новые данные ещё не лежат в Dropbox – сохраняем все разделы
+                tasks_by_user[chat_id].mark_dirty()
     return tasks_by_user[chat_id]
 
 def save_user_data(chat_id):
-    """Сохранить данные пользователя."""
+    """
+    Сохранить данные пользователя (только разделы, отмеченные mark_dirty).
+    Заливка в Dropbox идёт в фоне (write_behind), хендлер её не ждёт.
+    """
     if chat_id in tasks_by_user:
-        save_data(chat_id, tasks_by_user[chat_id])
+        batch = _batch(chat_id)
+        if batch is not None:
+            # В пачке апдейтов сохраняем один раз – в конце (process_batch)
+            batch.save = True
+            return
+        schedule_save(chat_id, tasks_by_user[chat_id])
 
-def format_list(section, item_list):
-    """Вернуть текстовое представление списка задач для раздела или подзадач."""
+def commit(chat_id, op):
+    """
+    Применить изменение op (см. mutations.py) к данным пользователя
+    и поставить его на сохранение. Возвращает действие undo.
+    """
+    user_data = get_user_data(chat_id)
+    # Под замком пользователя (тем же, что у save_data): свёртка журнала
+    # не вклинится между изменением данных и его записью в журнал
+    with user_lock(chat_id):
+        action = apply_op(user_data, op)
+        record_op(chat_id, user_data, op, action)
+    save_user_data(chat_id)
+    return action
+
+def format_list(section, item_list, start=0):
+    """
+    Вернуть текстовое представление списка задач для раздела или подзадач.
+    item_list – видимый срез списка, start – его начало (номера сквозные).
+    """
     if not item_list:
         return "Нет задач."
     lines = []
-    for idx, item in enumerate(item_list, start=1):
-        line = f"{idx}. {item['title']}"
-        if item['children']:
+    for idx, item in enumerate(item_list, start=start + 1):
+        line = f"{idx}. {item.title}"
+        if item.child_count:
             # Отметим наличие подзадач (количество)
-            line += f" ({len(item['children'])} подзадач)"
+            line += f" ({item.child_count} подзадач)"
         lines.append(line)
     return "\n".join(lines)
 
-def send_section(chat_id, section, parent_index=None):
-    """Отправить сообщение со списком задач раздела или вложенных задач элемента."""
+def send_section(chat_id, section, parent_index=None, message_id=None):
+    """
+    Отправить сообщение со списком задач раздела или вложенных задач элемента.
+    message_id – сообщение с этим же списком, на которое ответил пользователь:
+    при EDIT_IN_PLACE оно правится на месте вместо отправки нового
+    (и остаётся на своей странице).
+    """
+    batch = _batch(chat_id)
+    if batch is not None and not batch.flushing:
+        # В пачке апдейтов список покажем один раз – после всех изменений
+        # (если хоть раз список просили показать заново – шлём новое сообщение)
+        key = (section, parent_index)
+        if key in batch.sections and batch.sections.pop(key) is None:
+            message_id = None
+        batch.sections[key] = message_id
+        return None
+    return show_section(chat_id, section, parent_index, message_id)
+
+def show_section(chat_id, section, parent_index=None, message_id=None, page=None):
+    """
+    Показать страницу page списка: правкой сообщения message_id или новым
+    сообщением. page=None – страница, на которой сообщение уже стоит
+    (для нового сообщения – первая).
+    """
     user_data = get_user_data(chat_id)
+    if parent_index is not None and not 0 <= parent_index < len(user_data.get(section, [])):
+        reply(chat_id, "Элемент не найден.")
+        return None
+    if page is None:
+        shown = list_texts.get(_context_key(chat_id, message_id)) if message_id is not None else None
+        page = shown[1] if shown else 0
+    # Текст страницы берём из кэша, пока раздел не менялся (render_cache.py)
+    text, page, pages = cached(("list", page), chat_id, section, parent_index, user_data.version(section),
+                               lambda: render_section(user_data, section, parent_index, page))
+    markup = page_keyboard(section, parent_index, page, pages)
+    if EDIT_IN_PLACE and message_id is not None and edit_section(chat_id, message_id, text, page, markup):
+        return None
+    # Отправляем сообщение со списком
+    if markup is None:
+        sent = bot.send_message(chat_id, text)
+    else:
+        sent = bot.send_message(chat_id, text, reply_markup=markup)
+    # Сохраняем контекст для возможности ответов на это сообщение
+    remember_context(chat_id, sent.message_id, section, parent_index)
+    list_texts.set(_context_key(chat_id, sent.message_id), (text, page))
+    return sent
+
+def render_section(user_data, section, parent_index=None, page=0):
+    """
+    Страница списка задач раздела или вложенных задач элемента:
+    (text, page, pages). Форматируется только видимый срез.
+    """
     if parent_index is None:
         # верхний уровень раздела
         header = section.capitalize() if section.lower() != "sos" else "SOS"
         header += ":"
         item_list = user_data.get(section, [])
-        text = header + "\n" + (format_list(section, item_list) if item_list else "Нет задач.")
     else:
         # вложенные задачи элемента (например, задачи проекта или шаблона)
-        parent_list = user_data.get(section, [])
-        if parent_index < 0 or parent_index >= len(parent_list):
-            bot.send_message(chat_id, "Элемент не найден.")
-            return None
-        parent_item = parent_list[parent_index]
+        parent_item = user_data.get(section, [])[parent_index]
         # Заголовок: название элемента (проекта/шаблона/рутины)
-        title = parent_item["title"]
+        title = parent_item.title
         # Добавим тип в заголовок для ясности (например, "Проект: ...")
         if section == "projects":
             header = f"Проект: {title}:"
@@ -112,22 +298,50 @@ def send_section(chat_id, section, parent_index=None):
             header = f"Рутина: {title}:"
         else:
             header = title + ":"
-        item_list = parent_item["children"]
-        text = header + "\n" + (format_list(section, item_list) if item_list else "Нет задач.")
-    # Отправляем сообщение со списком
-    sent = bot.send_message(chat_id, text)
-    # Сохраняем контекст для возможности ответов на это сообщение
-    context_map[(chat_id, sent.message_id)] = (section, parent_index)
-    return sent
+        item_list = parent_item.children
+    page, pages, start, end = window(len(item_list), page)
+    text = header + "\n" + format_list(section, item_list[start:end], start)
+    if pages > 1:
+        text += f"\n\nСтр. {page + 1}/{pages}"
+    if len(text) > MAX_MESSAGE_LEN:
+        # Очень длинные названия: страница всё равно должна уйти одним сообщением
+        text = text[:MAX_MESSAGE_LEN - 1] + "…"
+    return text, page, pages
+
+def page_keyboard(section, parent_index, page, pages):
+    """Кнопки ◀/▶ для листания списка (None, если страница одна)."""
+    if pages <= 1:
+        return None
+    parent = "-" if parent_index is None else parent_index
+    buttons = []
+    if page > 0:
+        buttons.append(types.InlineKeyboardButton("◀", callback_data=f"page:{section}:{parent}:{page - 1}"))
+    if page < pages - 1:
+        buttons.append(types.InlineKeyboardButton("▶", callback_data=f"page:{section}:{parent}:{page + 1}"))
+    kb = types.InlineKeyboardMarkup()
+    kb.row(*buttons)
+    return kb
 
-def push_undo(chat_id, action):
-    """Добавить действие в стек для undo (ограничение 5 записей)."""
-    if chat_id not in undo_stack:
-        undo_stack[chat_id] = []
-    undo_stack[chat_id].append(action)
-    # Ограничим размер стека последних действий
-    if len(undo_stack[chat_id]) > 5:
-        undo_stack[chat_id].pop(0)
+def edit_section(chat_id, message_id, text, page=0, markup=None):
+    """
+    Заменить текст сообщения со списком. False – править не вышло
+    (сообщение удалено, слишком старое и т.п.), нужно отправить новое.
+    Контекст сообщения не меняется: это тот же раздел/элемент.
+    """
+    key = _context_key(chat_id, message_id)
+    # Кнопки листания зависят только от страницы, а она видна в тексте
+    if list_texts.get(key) == (text, page):
+        return True
+    try:
+        bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=markup)
+    except Exception as e:
+        # Telegram отвечает ошибкой, если текст тот же (например, после
+        # рестарта, когда показанный текст не в памяти) – это не сбой
+        if "message is not modified" not in str(e):
+            print(f"[main] edit list {message_id} in chat {chat_id} failed: {e}")
+            return False
+    list_texts.set(key, (text, page))
+    return True
 
 @bot.message_handler(commands=['start'])
 def start_handler(message):
@@ -136,7 +350,7 @@ def start_handler(message):
 
     chat_id = message.chat.id
     get_user_data(chat_id)
-    bot.send_message(
+    reply(
         chat_id,
         "Привет! Я Smart Planner Bot – помогу спланировать дела.\n"
         "Для справки по командам введите /help",
@@ -210,7 +424,7 @@ def help_handler(message):
         "- `/del <N или N-M>` – удалить задачу(и) из текущего списка. Можно указать один номер либо диапазон через дефис (например, `3-5`). Команда отправляется ответом на сообщение со списком. Удаленные задачи можно восстановить командой `/undo`.\n"
         "- `/undo` – отменить последнее действие (доступно до 5 последних изменений). Отменяет добавление, редактирование, перемещение или удаление задачи."
     )
-    bot.send_message(chat_id, help_text, parse_mode="Markdown")
+    reply(chat_id, help_text, parse_mode="Markdown")
 
 @bot.message_handler(commands=['open'])
 def open_handler(message):
@@ -218,19 +432,19 @@ def open_handler(message):
     user_data = get_user_data(chat_id)
     args = message.text.split(maxsplit=1)
     if len(args) < 2:
-        bot.send_message(chat_id, "Укажите, что открыть: раздел (inbox/today/...) или номер элемента.")
+        reply(chat_id, "Укажите, что открыть: раздел (inbox/today/...) или номер элемента.")
         return
     query = args[1].strip()
     # Если аргумент - число, пытаемся открыть вложенный список по номеру
     if query.isdigit():
         # Должно быть ответом на сообщение списка
         if not message.reply_to_message:
-            bot.send_message(chat_id, "Для открытия элемента отправьте команду в ответ на сообщение со списком.")
+            reply(chat_id, "Для открытия элемента отправьте команду в ответ на сообщение со списком.")
             return
         # Получаем контекст из ответного сообщения
-        ctx = context_map.get((chat_id, message.reply_to_message.message_id))
+        ctx = get_context(chat_id, message.reply_to_message.message_id)
         if not ctx:
-            bot.send_message(chat_id, "Контекст списка не найден.")
+            reply(chat_id, "Контекст списка не найден.")
             return
         section, parent_index = ctx
         index = int(query) - 1  # перевод в 0-индекс
@@ -247,7 +461,7 @@ def open_handler(message):
         if sec in SECTIONS:
             send_section(chat_id, sec, parent_index=None)
         else:
-            bot.send_message(chat_id, f"Раздел *{query}* не найден. Используйте один из: " 
+            reply(chat_id, f"Раздел *{query}* не найден. Используйте один из: " 
                                       "inbox, today, routines, templates, projects, habits, sos.", parse_mode="Markdown")
 
 @bot.message_handler(commands=['add'])
@@ -257,112 +471,89 @@ def add_handler(message):
     # Извлекаем текст задачи
     parts = message.text.split(maxsplit=1)
     if len(parts) < 2 or not parts[1].strip():
-        bot.send_message(chat_id, "После команды /add укажите текст задачи.")
+        reply(chat_id, "После команды /add укажите текст задачи.")
         return
     task_text = parts[1].strip()
     # Определяем целевой список (раздел)
     if message.reply_to_message:
-        ctx = context_map.get((chat_id, message.reply_to_message.message_id))
+        ctx = get_context(chat_id, message.reply_to_message.message_id)
         if not ctx:
             # Если вдруг нет контекста
-            bot.send_message(chat_id, "Не удалось определить раздел для добавления задачи.")
+            reply(chat_id, "Не удалось определить раздел для добавления задачи.")
             return
         section, parent_index = ctx
     else:
         # Если команда без ответа – добавляем в Inbox
         section, parent_index = "inbox", None
-    # Создаем новую задачу (элемент)
-    new_item = {"title": task_text, "children": []}
-    if parent_index is None:
-        # Добавляем на верхний уровень выбранного раздела
-        user_data[section].append(new_item)
-    else:
+    if parent_index is not None:
         # Добавляем как подзадачу к выбранному элементу (проекту/шаблону/рутине)
         parent_list = user_data[section]
         if parent_index < 0 or parent_index >= len(parent_list):
-            bot.send_message(chat_id, "Не найден элемент для добавления подзадачи.")
+            reply(chat_id, "Не найден элемент для добавления подзадачи.")
             return
-        parent_item = parent_list[parent_index]
-        parent_item["children"].append(new_item)
-    # Сохраняем действие для undo
-    undo_action = {
-        "type": "add",
-        "section": section,
-        "parent": parent_index,
-        "item": new_item
-    }
-    push_undo(chat_id, undo_action)
-    save_user_data(chat_id)
+    # Создаем новую задачу (элемент); действие попадёт в стек undo
+    new_item = {"title": task_text, "children": []}
+    commit(chat_id, {"op": "add", "section": section, "parent": parent_index, "item": new_item})
     # Отправляем подтверждение/обновленный список
     if message.reply_to_message:
         # Обновляем текущий список раздела
-        send_section(chat_id, section, parent_index=parent_index)
+        send_section(chat_id, section, parent_index=parent_index,
+                     message_id=message.reply_to_message.message_id)
     else:
-        bot.send_message(chat_id, f"Задача добавлена в раздел *{section.capitalize()}*.", parse_mode="Markdown")
+        reply(chat_id, f"Задача добавлена в раздел *{section.capitalize()}*.", parse_mode="Markdown")
 
 @bot.message_handler(commands=['edit'])
 def edit_handler(message):
     chat_id = message.chat.id
     user_data = get_user_data(chat_id)
     if not message.reply_to_message:
-        bot.send_message(chat_id, "Команду /edit нужно отправлять ответом на сообщение со списком задач.")
+        reply(chat_id, "Команду /edit нужно отправлять ответом на сообщение со списком задач.")
         return
-    ctx = context_map.get((chat_id, message.reply_to_message.message_id))
+    ctx = get_context(chat_id, message.reply_to_message.message_id)
     if not ctx:
-        bot.send_message(chat_id, "Контекст списка не найден.")
+        reply(chat_id, "Контекст списка не найден.")
         return
     section, parent_index = ctx
     # Парсим команду: ожидается "/edit N новый текст"
     args = message.text.split(maxsplit=2)
     if len(args) < 3:
-        bot.send_message(chat_id, "Используйте формат: /edit <номер> <новый текст задачи> (команду отправлять ответом на список).")
+        reply(chat_id, "Используйте формат: /edit <номер> <новый текст задачи> (команду отправлять ответом на список).")
         return
     try:
         idx = int(args[1]) - 1
     except ValueError:
-        bot.send_message(chat_id, "Номер задачи должен быть числом.")
+        reply(chat_id, "Номер задачи должен быть числом.")
         return
     new_text = args[2].strip()
     if parent_index is None:
         item_list = user_data.get(section, [])
     else:
         parent_item = user_data.get(section, [])[parent_index]
-        item_list = parent_item["children"]
+        item_list = parent_item.children
     if idx < 0 or idx >= len(item_list):
-        bot.send_message(chat_id, "Задача с таким номером не найдена.")
+        reply(chat_id, "Задача с таким номером не найдена.")
         return
-    item = item_list[idx]
-    old_text = item["title"]
-    item["title"] = new_text
-    # Сохраняем действие для undo
-    undo_action = {
-        "type": "edit",
-        "section": section,
-        "parent": parent_index,
-        "item": item,
-        "old_text": old_text
-    }
-    push_undo(chat_id, undo_action)
-    save_user_data(chat_id)
-    # Отправляем обновленный список
-    send_section(chat_id, section, parent_index=parent_index)
+    commit(chat_id, {"op": "edit", "section": section, "parent": parent_index, "index": idx, "title": new_text})
+    # Обновляем список, на который ответил пользователь
+    send_section(chat_id, section, parent_index=parent_index,
+                 message_id=message.reply_to_message.message_id)
 
 @bot.message_handler(commands=['mv'])
 def mv_handler(message):
     chat_id = message.chat.id
     user_data = get_user_data(chat_id)
     if not message.reply_to_message:
-        bot.send_message(chat_id, "Команду /mv нужно отправлять ответом на сообщение со списком задач, откуда переносить.")
+        reply(chat_id, "Команду /mv нужно отправлять ответом на сообщение со списком задач, откуда переносить.")
         return
-    ctx = context_map.get((chat_id, message.reply_to_message.message_id))
+    ctx = get_context(chat_id, message.reply_to_message.message_id)
     if not ctx:
-        bot.send_message(chat_id, "Контекст списка не найден.")
+        reply(chat_id, "Контекст списка не найден.")
         return
     section, parent_index = ctx
     # Парсим команду: ожидается "/mv 1-3 to section"
     args = message.text.split()
     if len(args) < 3:
-        bot.send_message(chat_id, "Используйте формат: /mv <N или N-M> to <раздел>.")
+        reply(chat_id, "Используйте формат: /mv <N или N-M> to <раздел>.")
         return
     # Объединяем все аргументы кроме команды и 'to'
     try:
@@ -370,18 +561,18 @@ def mv_handler(message):
     except ValueError:
         to_index = args.index("to".capitalize()) if "to".capitalize() in args else -1
     if to_index == -1:
-        bot.send_message(chat_id, "Укажите раздел назначения после 'to'.")
+        reply(chat_id, "Укажите раздел назначения после 'to'.")
         return
     selection_str = " ".join(args[1:to_index])
     dest_section = args[to_index+1].lower() if to_index+1 < len(args) else ""
     if dest_section not in SECTIONS:
-        bot.send_message(chat_id, f"Недопустимый раздел назначения: {dest_section}.")
+        reply(chat_id, f"Недопустимый раздел назначения: {dest_section}.")
         return
     # Получаем список исходных задач
     if parent_index is None:
         src_list = user_data.get(section, [])
     else:
-        src_list = user_data.get(section, [])[parent_index]["children"]
+        src_list = user_data.get(section, [])[parent_index].children
     # Разбираем диапазоны и номера
     # Поддерживаем синтаксис: "N", "N-M", "N, M, K-L"
     selection_str = selection_str.replace(",", " ")
@@ -394,7 +585,7 @@ def mv_handler(message):
                 start = int(a)
                 end = int(b)
             except:
-                bot.send_message(chat_id, f"Некорректный диапазон: {part}")
+                reply(chat_id, f"Некорректный диапазон: {part}")
                 return
             if start > end:
                 start, end = end, start
@@ -404,72 +595,50 @@ def mv_handler(message):
                 n = int(part)
                 indices.append(n)
             except:
-                bot.send_message(chat_id, f"Некорректный номер задачи: {part}")
+                reply(chat_id, f"Некорректный номер задачи: {part}")
                 return
     # Убираем дубликаты и сортируем
     indices = sorted(set(indices))
     if not indices:
-        bot.send_message(chat_id, "Не указаны корректные номера задач для перемещения.")
+        reply(chat_id, "Не указаны корректные номера задач для перемещения.")
         return
     # Переводим в 0-based индексы и проверяем границы
     indices0 = [i-1 for i in indices]
     max_index = len(src_list) - 1
     for i0 in indices0:
         if i0 < 0 or i0 > max_index:
-            bot.send_message(chat_id, f"Задачи с номером {i0+1} не существует.")
+            reply(chat_id, f"Задачи с номером {i0+1} не существует.")
             return
-    # Сохраняем перемещаемые элементы и их исходные позиции
-    moved_items = [src_list[i] for i in indices0]
-    orig_positions = indices0[:]  # копия списка
-    # Удаляем элементы из исходного списка (с конца, чтобы индексы не сдвинулись до удаления)
-    for i in sorted(indices0, reverse=True):
-        src_list.pop(i)
-    # Добавляем элементы в целевой раздел (в конец списка целевого раздела)
-    # Если переносим подзадачи из проекта/шаблона, они станут обычными задачами в новом разделе
-    dest_list = user_data.get(dest_section)
-    if dest_list is None:
-        user_data[dest_section] = []
-        dest_list = user_data[dest_section]
-    for item in moved_items:
-        dest_list.append(item)
-    # Сохраняем действие для undo
-    undo_action = {
-        "type": "mv",
-        "section": section,
-        "parent": parent_index,
-        "dest_section": dest_section,
-        "dest_parent": None,  # (перенос всегда на верхний уровень другого раздела)
-        "items": moved_items,
-        "orig_positions": orig_positions
-    }
-    push_undo(chat_id, undo_action)
-    save_user_data(chat_id)
+    # Переносим элементы в конец целевого раздела (действие попадёт в стек undo)
+    action = commit(chat_id, {"op": "mv", "section": section, "parent": parent_index,
+                              "indices": indices0, "dest": dest_section})
     # Отправляем сообщение об успешном переносе и обновляем исходный список
-    bot.send_message(chat_id, f"Перенесено задач: {len(moved_items)} -> раздел *{dest_section.capitalize()}*.", parse_mode="Markdown")
-    send_section(chat_id, section, parent_index=parent_index)
+    reply(chat_id, f"Перенесено задач: {len(action['items'])} -> раздел *{dest_section.capitalize()}*.", parse_mode="Markdown")
+    send_section(chat_id, section, parent_index=parent_index,
+                 message_id=message.reply_to_message.message_id)
 
 @bot.message_handler(commands=['del'])
 def del_handler(message):
     chat_id = message.chat.id
     user_data = get_user_data(chat_id)
     if not message.reply_to_message:
-        bot.send_message(chat_id, "Команду /del нужно отправлять ответом на сообщение со списком задач.")
+        reply(chat_id, "Команду /del нужно отправлять ответом на сообщение со списком задач.")
         return
-    ctx = context_map.get((chat_id, message.reply_to_message.message_id))
+    ctx = get_context(chat_id, message.reply_to_message.message_id)
     if not ctx:
-        bot.send_message(chat_id, "Контекст списка не найден.")
+        reply(chat_id, "Контекст списка не найден.")
         return
     section, parent_index = ctx
     args = message.text.split(maxsplit=1)
     if len(args) < 2:
-        bot.send_message(chat_id, "Укажите номер или диапазон задач для удаления.")
+        reply(chat_id, "Укажите номер или диапазон задач для удаления.")
         return
     selection_str = args[1]
     # Получаем целевой список
     if parent_index is None:
         target_list = user_data.get(section, [])
     else:
-        target_list = user_data.get(section, [])[parent_index]["children"]
+        target_list = user_data.get(section, [])[parent_index].children
     # Парсим диапазоны/номера (логика аналогично mv)
     selection_str = selection_str.replace(",", " ")
     parts = selection_str.split()
@@ -481,7 +650,7 @@ def del_handler(message):
                 start = int(a)
                 end = int(b)
             except:
-                bot.send_message(chat_id, f"Некорректный диапазон: {part}")
+                reply(chat_id, f"Некорректный диапазон: {part}")
                 return
             if start > end:
                 start, end = end, start
@@ -491,135 +660,162 @@ def del_handler(message):
                 n = int(part)
                 indices.append(n)
             except:
-                bot.send_message(chat_id, f"Некорректный номер задачи: {part}")
+                reply(chat_id, f"Некорректный номер задачи: {part}")
                 return
     indices = sorted(set(indices))
     if not indices:
-        bot.send_message(chat_id, "Не указаны корректные номера задач.")
+        reply(chat_id, "Не указаны корректные номера задач.")
         return
     indices0 = [i-1 for i in indices]
     max_index = len(target_list) - 1
     for i0 in indices0:
         if i0 < 0 or i0 > max_index:
-            bot.send_message(chat_id, f"Задачи с номером {i0+1} не существует.")
+            reply(chat_id, f"Задачи с номером {i0+1} не существует.")
             return
-    # Сохраняем удаляемые задачи и их позиции
-    deleted_items = []
-    deleted_positions = []
-    for i in sorted(indices0, reverse=True):
-        deleted_items.insert(0, target_list.pop(i))  # вставляем в начало, чтобы итоговый порядок соответствовал исходному
-        deleted_positions.insert(0, i)
-    # Логика: deleted_items теперь в порядке возрастания оригинальных индексов
-    undo_action = {
-        "type": "del",
-        "section": section,
-        "parent": parent_index,
-        "items": deleted_items,
-        "positions": deleted_positions
-    }
-    push_undo(chat_id, undo_action)
-    save_user_data(chat_id)
-    bot.send_message(chat_id, f"Удалено задач: {len(deleted_items)}.")
+    # Удаляем задачи; они и их позиции попадут в стек undo
+    action = commit(chat_id, {"op": "del", "section": section, "parent": parent_index, "indices": indices0})
+    reply(chat_id, f"Удалено задач: {len(action['items'])}.")
     # Обновляем список на экране
-    send_section(chat_id, section, parent_index=parent_index)
+    send_section(chat_id, section, parent_index=parent_index,
+                 message_id=message.reply_to_message.message_id)
 
 @bot.message_handler(commands=['undo'])
 def undo_handler(message):
     chat_id = message.chat.id
-    if chat_id not in undo_stack or not undo_stack[chat_id]:
-        bot.send_message(chat_id, "Нет действий для отмены.")
-        return
     user_data = get_user_data(chat_id)
-    action = undo_stack[chat_id].pop()  # получаем последнее действие
-    typ = action["type"]
-    if typ == "add":
-        sec = action["section"]
-        par = action["parent"]
-        item = action["item"]
-        # Найдем и удалим добавленный элемент из соответствующего списка
-        if par is None:
-            # верхний уровень
-            if item in user_data[sec]:
-                user_data[sec].remove(item)
-        else:
-            parent_item = user_data.get(sec, [])[par]
-            if item in parent_item["children"]:
-                parent_item["children"].remove(item)
-        bot.send_message(chat_id, "Добавление задачи отменено.")
-        # Обновим список, если он открыт
-        send_section(chat_id, sec, parent_index=par)
-    elif typ == "edit":
-        sec = action["section"]
-        par = action["parent"]
-        item = action["item"]
-        old_text = action["old_text"]
-        # Вернем старый текст
-        item["title"] = old_text
-        bot.send_message(chat_id, "Изменение задачи отменено.")
-        # Обновим список, чтобы отобразить старый текст
-        send_section(chat_id, sec, parent_index=par)
-    elif typ == "mv":
-        sec = action["section"]
-        par = action["parent"]
-        dest_sec = action["dest_section"]
-        items = action["items"]
-        orig_positions = action["orig_positions"]
-        # Удаляем элементы из раздела-назначения
-        dest_list = user_data.get(dest_sec, [])
-        for it in items:
-            if it in dest_list:
-                dest_list.remove(it)
-        # Вставляем элементы обратно в исходный список на исходные позиции
-        target_list = user_data.get(sec, [])
-        if par is None:
-            # верхний уровень
-            for pos, it in sorted(zip(orig_positions, items), key=lambda x: x[0]):
-                if pos <= len(target_list):
-                    target_list.insert(pos, it)
-                else:
-                    # если позиция вне текущих границ (на случай), добавим в конец
-                    target_list.append(it)
-        else:
-            parent_item = target_list[par]
-            child_list = parent_item["children"]
-            for pos, it in sorted(zip(orig_positions, items), key=lambda x: x[0]):
-                if pos <= len(child_list):
-                    child_list.insert(pos, it)
-                else:
-                    child_list.append(it)
-        bot.send_message(chat_id, "Перемещение задач отменено.")
-        # Обновим исходный список (предполагаем, что именно он сейчас открыт у пользователя)
-        send_section(chat_id, sec, parent_index=par)
-    elif typ == "del":
-        sec = action["section"]
-        par = action["parent"]
-        items = action["items"]
-        positions = action["positions"]
-        # Вставляем удаленные задачи обратно на их исходные позиции
-        target_list = user_data.get(sec, [])
-        if par is None:
-            for pos, it in zip(positions, items):
-                if pos <= len(target_list):
-                    target_list.insert(pos, it)
-                else:
-                    target_list.append(it)
-        else:
-            parent_item = target_list[par]
-            child_list = parent_item["children"]
-            for pos, it in zip(positions, items):
-                if pos <= len(child_list):
-                    child_list.insert(pos, it)
-                else:
-                    child_list.append(it)
-        bot.send_message(chat_id, "Удаление задач отменено.")
-        send_section(chat_id, sec, parent_index=par)
-    save_user_data(chat_id)
+    if not user_data.undo:
+        reply(chat_id, "Нет действий для отмены.")
+        return
+    # Отменяем последнее действие (логика отмены – в mutations.py)
+    action = commit(chat_id, {"op": "undo"})
+    messages = {
+        "add": "Добавление задачи отменено.",
+        "edit": "Изменение задачи отменено.",
+        "mv": "Перемещение задач отменено.",
+        "del": "Удаление задач отменено.",
+    }
+    reply(chat_id, messages[action["type"]])
+    # Обновим исходный список (предполагаем, что именно он сейчас открыт у пользователя).
+    # Если /undo прислан ответом на этот же список – правим его на месте.
+    message_id = None
+    if message.reply_to_message:
+        replied = message.reply_to_message.message_id
+        if get_context(chat_id, replied) == (action["section"], action["parent"]):
+            message_id = replied
+    send_section(chat_id, action["section"], parent_index=action["parent"], message_id=message_id)
+
+@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("page:"))
+def page_callback(call):
+    """Кнопки ◀/▶ под списком: перелистнуть сообщение на другую страницу."""
+    try:
+        _, section, parent, page = call.data.split(":")
+        parent_index = None if parent == "-" else int(parent)
+        page = int(page)
+    except ValueError:
+        bot.answer_callback_query(call.id)
+        return
+    if call.message is not None and section in SECTIONS:
+        # Листание правит сообщение сразу – и в пачке апдейтов тоже
+        show_section(call.message.chat.id, section, parent_index,
+                     message_id=call.message.message_id, page=page)
+    bot.answer_callback_query(call.id)
 
 # Отключаем какую-либо клавиатуру меню по умолчанию (не используем custom keyboard)
 # bot.set_my_commands([])  # Можно очистить список команд меню, если необходимо
 
 
 # ====== WEBHOOK ======
+#
+# Апдейты одного чата обрабатываются строго по очереди (замок на chat_id):
+# иначе два хендлера под многопоточным сервером меняют одни и те же данные
+# пользователя вперемешку. Разные чаты идут параллельно, так что число
+# потоков сервера можно поднимать.
+# Замок чата – это storage.user_lock: его же держат снимок для сохранения
+# и подмена разделов, изменённых в Dropbox извне (change_feed.py), поэтому
+# раздел не поменяется между проверкой номера в хендлере и самим изменением.
+# Заливку в Dropbox и скачивание сохранение и change_feed делают уже без
+# замка – хендлер их не ждёт.
+
+
+def chat_lock(chat_id):
+    """Замок чата (тот же, что storage.user_lock для этого id)."""
+    return user_lock(chat_id)
+
+
+def update_ids(update):
+    """(chat_id, user_id) апдейта; None, если их нет."""
+    if update.message:
+        user = update.message.from_user
+        return update.message.chat.id, user.id if user else None
+    if update.callback_query:
+        cq = update.callback_query
+        chat_id = cq.message.chat.id if cq.message else cq.from_user.id
+        return chat_id, cq.from_user.id
+    return None, None
+
+
+def process_batch(chat_id, updates):
+    """
+    Обработать подряд апдейты одного чата (polling.py): изменения применяются
+    по очереди, данные сохраняются один раз, ответы уходят в конце
+    склеенными, списки – по разу.
+    Возвращает False, если изменения пачки не сохранились (они остались
+    в очереди write_behind, см. flush_chat).
+    """
+    with chat_lock(chat_id):
+        batch = _local.batch = UpdateBatch(chat_id)
+        saved = True
+        try:
+            for update in updates:
+                try:
+                    bot.process_new_updates([update])
+                except Exception as e:
+                    print(f"[batch] update {update.update_id} failed: {e}")
+        finally:
+            # Сохраняем до ответов: упавшая отправка не должна терять изменения
+            if batch.save:
+                saved = flush_chat(chat_id)
+        try:
+            batch.flushing = True
+            _send_replies(batch)
+            for (section, parent_index), message_id in batch.sections.items():
+                try:
+                    send_section(chat_id, section, parent_index=parent_index, message_id=message_id)
+                except Exception as e:
+                    print(f"[batch] list {section} failed for chat {chat_id}: {e}")
+        finally:
+            _local.batch = None
+        return saved
+
+
+def flush_chat(chat_id):
+    """
+    Сразу сохранить данные чата. Если не вышло – ставим в очередь
+    write_behind и возвращаем False.
+    """
+    if chat_id not in tasks_by_user:
+        return True
+    try:
+        save_data(chat_id, tasks_by_user[chat_id])
+        return True
+    except Exception as e:
+        print(f"[batch] save error for chat {chat_id}: {e}")
+    try:
+        schedule_save(chat_id, tasks_by_user[chat_id])
+    except Exception as e:
+        # WRITE_BEHIND=0: schedule_save сохраняет сразу и тоже может упасть
+        print(f"[batch] save error for chat {chat_id}: {e}")
+    return False
+
+
+def process_update(update, chat_id):
+    """Передать апдейт хендлерам – под замком чата, если чат известен."""
+    if chat_id is None:
+        bot.process_new_updates([update])
+        return
+    with chat_lock(chat_id):
+        bot.process_new_updates([update])
+
 
 @app.route("/webhook", methods=["POST"])
 def webhook():
@@ -627,18 +823,13 @@ def webhook():
     json_str = request.get_data().decode("utf-8")
     update = telebot.types.Update.de_json(json_str)
 
-    # Пытаемся достать user_id из апдейта
-    user_id = None
-    if update.message and update.message.from_user:
-        user_id = update.message.from_user.id
-    elif update.callback_query and update.callback_query.from_user:
-        user_id = update.callback_query.from_user.id
+    chat_id, user_id = update_ids(update)
 
     # Если пользователь не в белом списке — просто игнорируем апдейт
-    if user_id is not None and not is_allowed(user_id):
+    if user_id is not None and user_id not in ALLOWED_USERS:
         return "IGNORED", 200
 
-    bot.process_new_updates([update])
+    process_update(update, chat_id)
     return "OK", 200
 
 
@@ -647,6 +838,16 @@ def index():
     return "ok", 200
 
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Счётчики кэшей контекста и отрисовки списков (размер, попадания, промахи, вытеснения)."""
+    return {
+        "context_map": context_map.stats(),
+        "list_texts": list_texts.stats(),
+        "render_cache": render_cache.stats(),
+    }, 200
+
+
 if __name__ == "__main__":
     # Снимаем старый вебхук (на всякий случай)
     bot.remove_webhook()
@@ -657,4 +858,5 @@ if __name__ == "__main__":
     bot.set_webhook(url=webhook_url)
 
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
\ No newline at end of file
+    # Хендлеры работают в потоках сервера (см. process_update)
+    app.run(host="0.0.0.0", port=port, threaded=True)
\ No newline at end of file
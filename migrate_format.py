@@ -0,0 +1,94 @@
+"""
+Перевод файлов разделов в Dropbox в другой формат (см. section_format.py):
+
+    python migrate_format.py --to msgpack            # все пользователи
+    python migrate_format.py --to json --user 123    # один пользователь
+    python migrate_format.py --to msgpack --dry-run  # только показать
+    python migrate_format.py --to json --compress zlib
+
+Сжатие – как у бота (STORAGE_COMPRESS) или по --compress (none – снять).
+Бот читает все форматы, поэтому переводить можно на работающем боте
+и по частям: файл, уже лежащий в нужном виде, пропускается, а прерванную
+миграцию достаточно запустить снова. Чтобы бот и дальше писал в новом
+формате, задайте ему STORAGE_FORMAT и STORAGE_COMPRESS.
+"""
+
+import argparse
+import sys
+
+import storage
+import section_format
+from dropbox.exceptions import ApiError
+from nodes import Node
+
+
+def migrate_file(filename, fmt, compress=None, dry_run=False):
+    """
+    Перевести один файл раздела. Возвращает (было байт, стало байт)
+    или None, если файла нет или он уже в нужном виде.
+    """
+    path = storage._path(filename)
+    try:
+        md, res = storage._dbx().files_download(path)
+    except ApiError as e:
+        if storage._is_not_found(e):
+            return None
+        raise
+    body = res.content
+    # Разбираем в узлы, как бот: тогда файл, уже записанный в нужном виде,
+    # кодируется байт в байт так же
+    items = section_format.decode(body, Node.from_json)
+    new_body = section_format.encode(items, fmt, compact=storage.JSON_COMPACT, compress=compress)
+    if new_body == body:
+        return None
+    if not dry_run:
+        # Заливаем поверх именно скачанной версии (см. STORAGE_CONDITIONAL_WRITES)
+        storage._remote_meta[path] = (md.content_hash, md.rev)
+        storage._upload_section(filename, items, fmt, compress)
+    return len(body), len(new_body)
+
+
+def user_bases(user=None):
+    """Папки пользователей: одного или всех из реестра (без реестра – корень)."""
+    if user is not None:
+        return [storage._user_base(user)]
+    users = storage.registered_users()
+    if not users:
+        return [""]
+    return sorted({storage._user_base(key) for key in users})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Перевод файлов разделов в другой формат")
+    parser.add_argument("--to", choices=section_format.FORMATS, required=True)
+    parser.add_argument("--user", help="id пользователя (по умолчанию – все из реестра)")
+    parser.add_argument("--compress", choices=("none", "zlib", "zstd"),
+                        help="сжатие (по умолчанию – STORAGE_COMPRESS)")
+    parser.add_argument("--dry-run", action="store_true", help="только посчитать размеры")
+    args = parser.parse_args(argv)
+
+    if storage.STORAGE_BACKEND != "dropbox" or storage.STORAGE_LAYOUT != "files":
+        print("[migrate] needs STORAGE_BACKEND=dropbox and STORAGE_LAYOUT=files")
+        return 1
+
+    compress = None if args.compress is None else ("" if args.compress == "none" else args.compress)
+    if compress == "zstd" and section_format.zstandard is None:
+        print("[migrate] zstd needs the zstandard package")
+        return 1
+    total_before = total_after = 0
+    for base in user_bases(args.user):
+        for filename in storage.SECTION_FILES.values():
+            result = migrate_file(base + filename, args.to, compress, args.dry_run)
+            if result is None:
+                continue
+            before, after = result
+            total_before += before
+            total_after += after
+            print(f"[migrate] {base}{filename}: {before} -> {after} bytes")
+    action = "would change" if args.dry_run else "changed"
+    print(f"[migrate] {action}: {total_before} -> {total_after} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+Изменения списков задач (слой мутаций).
+
+Каждое изменение описывается записью op – небольшим JSON-словарём:
+
+    {"op": "add",  "section": "inbox", "parent": None, "item": {...}}
+    {"op": "edit", "section": "inbox", "parent": None, "index": 0, "title": "..."}
+    {"op": "mv",   "section": "inbox", "parent": None, "indices": [0, 2], "dest": "today"}
+    {"op": "del",  "section": "inbox", "parent": None, "indices": [1]}
+    {"op": "undo", "revert": {...}}
+
+apply() применяет запись к данным пользователя, ведёт стек undo (data.undo),
+держит в актуальном состоянии индекс элементов по id (data.index) и меняет
+версию затронутых разделов (data.touch) – так кэш отрисовки списков
+(render_cache.py) узнаёт, что показанный текст устарел.
+Undo находит элементы по индексу и по идентичности объекта, а не по
+сравнению содержимого, – так отмена не путает задачи с одинаковым текстом.
+Один и тот же код работает и в хендлерах main.py, и при воспроизведении
+журнала (storage, STORAGE_JOURNAL=1) – поэтому после рестарта данные
+и история undo восстанавливаются одинаково.
+
+Стек undo в снимок при свёртке журнала не попадает, поэтому запись undo
+несёт и саму отмену в готовом виде (op["revert"], см. _revert_record):
+если при воспроизведении стек пуст (отменяемое действие было до свёртки),
+применяется она.
+"""
+
+from nodes import Node
+
+# Сколько последних действий можно отменить
+UNDO_DEPTH = 5
+
+
+def _target_list(data, section, parent):
+    """Список верхнего уровня раздела или подзадачи элемента parent."""
+    if parent is None:
+        return data[section]
+    return data[section][parent].children
+
+
+def _parent_id(data, section, parent):
+    return None if parent is None else data[section][parent].id
+
+
+def _remove_nodes(target_list, nodes):
+    """Убрать из списка именно эти объекты (не равные им по содержимому)."""
+    ids = {id(node) for node in nodes}
+    target_list[:] = [x for x in target_list if id(x) not in ids]
+
+
+def _insert_back(target_list, positions, items):
+    """Вернуть элементы на исходные позиции (по возрастанию позиций)."""
+    for pos, it in sorted(zip(positions, items), key=lambda x: x[0]):
+        if pos <= len(target_list):
+            target_list.insert(pos, it)
+        else:
+            # если позиция вне текущих границ (на случай), добавим в конец
+            target_list.append(it)
+
+
+def _add(data, op):
+    # Запись op остаётся с узлом: record_op сериализует его уже с id
+    item = op["item"] = Node.from_json(op["item"])
+    _target_list(data, op["section"], op["parent"]).append(item)
+    # Новому элементу выдаётся id (при воспроизведении журнала он уже есть)
+    data.index_node(op["section"], _parent_id(data, op["section"], op["parent"]), item)
+    return {"type": "add", "section": op["section"], "parent": op["parent"], "item": item}
+
+
+def _edit(data, op):
+    item = _target_list(data, op["section"], op["parent"])[op["index"]]
+    old_text = item.title
+    item.title = op["title"]
+    return {
+        "type": "edit",
+        "section": op["section"],
+        "parent": op["parent"],
+        "item": item,
+        "old_text": old_text,
+    }
+
+
+def _mv(data, op):
+    src_list = _target_list(data, op["section"], op["parent"])
+    indices0 = sorted(op["indices"])
+    moved_items = [src_list[i] for i in indices0]
+    # Удаляем элементы из исходного списка (с конца, чтобы индексы не сдвинулись до удаления)
+    for i in reversed(indices0):
+        src_list.pop(i)
+    # Добавляем в конец целевого раздела. Подзадачи проекта/шаблона
+    # становятся обычными задачами в новом разделе.
+    if data.get(op["dest"]) is None:
+        data[op["dest"]] = []
+    data[op["dest"]].extend(moved_items)
+    for it in moved_items:
+        data.index_node(op["dest"], None, it)
+    return {
+        "type": "mv",
+        "section": op["section"],
+        "parent": op["parent"],
+        "dest_section": op["dest"],
+        "dest_parent": None,  # (перенос всегда на верхний уровень другого раздела)
+        "items": moved_items,
+        "orig_positions": indices0,
+    }
+
+
+def _del(data, op):
+    target_list = _target_list(data, op["section"], op["parent"])
+    indices0 = sorted(op["indices"])
+    deleted_items = [target_list[i] for i in indices0]
+    for i in reversed(indices0):
+        target_list.pop(i)
+    for it in deleted_items:
+        data.unindex_node(it)
+    return {
+        "type": "del",
+        "section": op["section"],
+        "parent": op["parent"],
+        "items": deleted_items,
+        "positions": indices0,
+    }
+
+
+def _revert_record(action):
+    """
+    Отмена действия action в виде, не зависящем от стека undo: элементы
+    указаны по id, удалённые – целиком. Сохраняется в записи журнала.
+    """
+    record = {"type": action["type"], "section": action["section"], "parent": action["parent"]}
+    if action["type"] in ("add", "edit"):
+        record["id"] = action["item"].id
+        if action["type"] == "edit":
+            record["title"] = action["old_text"]
+    elif action["type"] == "mv":
+        record["dest_section"] = action["dest_section"]
+        record["ids"] = [it.id for it in action["items"]]
+        record["orig_positions"] = action["orig_positions"]
+    elif action["type"] == "del":
+        record["items"] = action["items"]
+        record["positions"] = action["positions"]
+    return record
+
+
+def _revert(data, record):
+    """
+    Применить отмену из записи журнала (_revert_record) – при
+    воспроизведении, когда отменяемого действия нет в стеке undo.
+    Возвращает действие в том же виде, что и _undo.
+    """
+    typ = record["type"]
+    sec = record["section"]
+    par = record["parent"]
+    action = dict(record)
+    if typ == "add":
+        entry = data.find(record["id"])
+        if entry is not None:
+            _remove_nodes(data.container(record["id"]), [entry[2]])
+            data.unindex_node(entry[2])
+    elif typ == "edit":
+        entry = data.find(record["id"])
+        if entry is not None:
+            entry[2].title = record["title"]
+    elif typ == "mv":
+        items = [entry[2] for entry in map(data.find, record["ids"]) if entry is not None]
+        _remove_nodes(data.get(record["dest_section"], []), items)
+        _insert_back(_target_list(data, sec, par), record["orig_positions"], items)
+        for it in items:
+            data.index_node(sec, _parent_id(data, sec, par), it)
+        action["items"] = items
+    elif typ == "del":
+        items = [Node.from_json(it) for it in record["items"]]
+        _insert_back(_target_list(data, sec, par), record["positions"], items)
+        for it in items:
+            data.index_node(sec, _parent_id(data, sec, par), it)
+        action["items"] = items
+    return action
+
+
+def _undo(data):
+    """Отменить последнее действие. Возвращает отменённое действие или None."""
+    if not data.undo:
+        return None
+    action = data.undo.pop()
+    typ = action["type"]
+    sec = action["section"]
+    par = action["parent"]
+    if typ == "add":
+        item = action["item"]
+        if data.find(item.id) is not None:
+            _remove_nodes(data.container(item.id), [item])
+            data.unindex_node(item)
+    elif typ == "edit":
+        action["item"].title = action["old_text"]
+    elif typ == "mv":
+        _remove_nodes(data.get(action["dest_section"], []), action["items"])
+        _insert_back(_target_list(data, sec, par), action["orig_positions"], action["items"])
+        for it in action["items"]:
+            data.index_node(sec, _parent_id(data, sec, par), it)
+    elif typ == "del":
+        _insert_back(_target_list(data, sec, par), action["positions"], action["items"])
+        for it in action["items"]:
+            data.index_node(sec, _parent_id(data, sec, par), it)
+    return action
+
+
+_APPLY = {
+    "add": _add,
+    "edit": _edit,
+    "mv": _mv,
+    "del": _del,
+}
+
+
+def apply(data, op):
+    """
+    Применить запись op к data.
+    Возвращает действие для стека undo, а для {"op": "undo"} – отменённое
+    действие (или None, если отменять нечего).
+    """
+    if op["op"] == "undo":
+        if data.undo:
+            # Запись журнала должна отменять и без стека (см. _revert)
+            op["revert"] = _revert_record(data.undo[-1])
+            action = _undo(data)
+        elif op.get("revert"):
+            action = _revert(data, op["revert"])
+        else:
+            action = None
+    else:
+        action = _APPLY[op["op"]](data, op)
+        data.undo.append(action)
+        # Ограничим размер стека последних действий
+        if len(data.undo) > UNDO_DEPTH:
+            data.undo.pop(0)
+    data.touch(*touched_sections(action))
+    return action
+
+
+def touched_sections(action):
+    """Разделы, которые затронуло действие (для сохранения)."""
+    if action is None:
+        return ()
+    if action["type"] == "mv":
+        return (action["section"], action["dest_section"])
+    return (action["section"],)
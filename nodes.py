@@ -0,0 +1,193 @@
+"""
+Элемент списка (задача, проект, шаблон, рутина, ...) – общий для всех разделов.
+
+Node хранит частые поля в __slots__ (без словаря на каждый объект), а редкие
+(task_id, price, steps, ...) – в extra. Отсутствующее поле читается как None:
+node.task_id, node.price – без .get() с умолчаниями в каждом рендере.
+
+Дети из JSON не превращаются в Node сразу: сырой список лежит в узле до
+первого обращения к node.children. Так загрузка большого раздела не создаёт
+объекты для подзадач, которые никто не открывал, а запись обратно отдаёт
+сырой список как есть.
+
+Для совместимости узел понимает и словарный доступ: node["title"],
+node.get("done"), node["task_id"] = 5.
+"""
+
+import json
+
+# Поля, которые лежат прямо в слотах (остальное – в extra)
+_FIELDS = ("id", "title", "done", "comment", "created_at")
+
+
+class Node:
+    __slots__ = _FIELDS + ("extra", "_children", "_raw")
+
+    def __init__(self, title="", *, id=None, done=False, comment=None,
+                 created_at=None, children=None, extra=None):
+        self.id = id
+        self.title = title
+        self.done = done
+        self.comment = comment
+        self.created_at = created_at
+        # Пустые extra и список детей не заводим – это большая часть памяти узла
+        self.extra = extra or None
+        self._children = None
+        # Сырые дети из JSON – превращаются в Node при первом обращении
+        self._raw = children or None
+
+    @classmethod
+    def from_json(cls, obj):
+        """
+        Узел из JSON-значения (и старых форматов):
+        - Node -> он же;
+        - строка -> узел с таким заголовком;
+        - dict -> title (или старое поле text), children и известные поля
+          в слоты, остальное – в extra.
+        """
+        if isinstance(obj, Node):
+            return obj
+        if isinstance(obj, str):
+            return cls(obj)
+        if not isinstance(obj, dict):
+            return cls(str(obj))
+        fields = dict(obj)
+        title = fields.pop("title", None) or fields.pop("text", None) or str(obj)
+        fields.pop("text", None)
+        children = fields.pop("children", None)
+        if not isinstance(children, list):
+            children = None
+        return cls(
+            title,
+            id=fields.pop("id", None),
+            done=fields.pop("done", False),
+            comment=fields.pop("comment", None),
+            created_at=fields.pop("created_at", None),
+            children=children,
+            extra=fields,
+        )
+
+    def to_json(self) -> dict:
+        """
+        Поля узла для json.dumps(default=json_default). Дети отдаются как есть:
+        узлы кодировщик разберёт тем же default, сырые – пишутся без разбора.
+        """
+        out = {} if self.id is None else {"id": self.id}
+        out["title"] = self.title
+        if self.done:
+            out["done"] = True
+        if self.comment is not None:
+            out["comment"] = self.comment
+        if self.created_at is not None:
+            out["created_at"] = self.created_at
+        if self.extra:
+            out.update(self.extra)
+        out["children"] = self._raw or self._children or []
+        return out
+
+    @property
+    def children(self):
+        if self._raw is not None:
+            self._children = [Node.from_json(child) for child in self._raw]
+            self._raw = None
+        elif self._children is None:
+            self._children = []
+        return self._children
+
+    @children.setter
+    def children(self, value):
+        self._children = [Node.from_json(child) for child in value]
+        self._raw = None
+
+    @property
+    def children_loaded(self) -> bool:
+        """Дети уже превращены в Node (или их нет)."""
+        return self._raw is None
+
+    @property
+    def child_count(self) -> int:
+        """Число детей – без превращения сырых детей в Node."""
+        return len(self._raw or self._children or ())
+
+    def __getattr__(self, name):
+        # Сюда попадаем только для имён не из слотов: редкие поля из extra
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.extra.get(name) if self.extra else None
+
+    # --- словарный доступ (старый код работал с dict) ---
+
+    def __getitem__(self, key):
+        if key == "children":
+            return self.children
+        if key in _FIELDS:
+            return getattr(self, key)
+        if not self.extra:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key == "children":
+            self.children = value
+        elif key in _FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        if key == "children":
+            return True
+        if key in _FIELDS:
+            return getattr(self, key) is not None
+        return bool(self.extra) and key in self.extra
+
+    def get(self, key, default=None):
+        if key in _FIELDS or key == "children":
+            value = self[key]
+            return default if value is None else value
+        return self.extra.get(key, default) if self.extra else default
+
+    def __repr__(self):
+        return f"Node(id={self.id!r}, title={self.title!r})"
+
+
+def from_json_list(raw):
+    """Список узлов из JSON-списка (None и пустое значение – пустой список)."""
+    if not raw:
+        return []
+    return [Node.from_json(item) for item in raw]
+
+
+def max_id(items) -> int:
+    """Наибольший числовой id среди элементов и всех их детей (сырые не разбираем)."""
+    best = 0
+    stack = list(items)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Node):
+            node_id = node.id
+            stack.extend(node._raw or node._children or ())
+        elif isinstance(node, dict):
+            node_id = node.get("id")
+            children = node.get("children")
+            if isinstance(children, list):
+                stack.extend(children)
+        else:
+            continue
+        if isinstance(node_id, int) and node_id > best:
+            best = node_id
+    return best
+
+
+def json_default(obj):
+    """default= для json.dumps: узлы кодируются через to_json."""
+    if isinstance(obj, Node):
+        return obj.to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj, **kwargs) -> str:
+    """json.dumps, понимающий Node."""
+    return json.dumps(obj, ensure_ascii=False, default=json_default, **kwargs)
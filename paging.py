@@ -0,0 +1,25 @@
+"""
+Постраничный показ длинных списков.
+
+Список показывается окнами по LIST_PAGE_SIZE элементов: отрисовывается
+и отправляется только видимый срез, поэтому показ стоит одинаково для
+инбокса из 10 и из 10 000 задач и не упирается в предел Telegram
+на длину сообщения. Номера элементов сквозные – /del 45 работает
+и со второй страницы.
+"""
+
+import os
+
+PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", "20"))
+
+
+def window(total, page, size=PAGE_SIZE):
+    """
+    (page, pages, start, end) для списка из total элементов: номер страницы
+    приводится к допустимому (после удалений страниц может стать меньше),
+    items[start:end] – видимый срез.
+    """
+    pages = max(1, -(-total // size))
+    page = min(max(page, 0), pages - 1)
+    start = page * size
+    return page, pages, start, min(start + size, total)
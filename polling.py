@@ -0,0 +1,121 @@
+"""
+Приём апдейтов long-polling'ом (getUpdates) – альтернатива вебхуку:
+
+    python polling.py
+
+Апдейты забираются пачками до POLL_BATCH_SIZE и группируются по чатам.
+Апдейты одного чата разбираются подряд (main.process_batch): ответы
+склеиваются, каждый список показывается один раз, данные сохраняются
+один раз на пачку. Разные чаты – параллельно (POLL_WORKERS потоков).
+После простоя накопившиеся апдейты догоняются пачками, а не по одному.
+
+Следующая пачка запрашивается только после того, как предыдущая
+обработана и сохранена, – так Telegram не считает апдейт доставленным
+раньше времени.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+
+import main
+import write_behind
+from bot.telegram_api import tg_request
+
+POLL_BATCH_SIZE = int(os.environ.get("POLL_BATCH_SIZE", "100"))  # 1..100 (предел getUpdates)
+POLL_TIMEOUT = int(os.environ.get("POLL_TIMEOUT", "25"))        # long-polling, секунды
+POLL_WORKERS = int(os.environ.get("POLL_WORKERS", "8"))
+POLL_ERROR_DELAY = 3  # пауза после ошибки getUpdates, секунды
+
+_pool = ThreadPoolExecutor(max_workers=POLL_WORKERS, thread_name_prefix="poll")
+
+
+def fetch_updates(offset):
+    """Следующая пачка апдейтов (сырые dict): [] – апдейтов нет, None – ошибка."""
+    data = tg_request(
+        "getUpdates",
+        {
+            "offset": offset,
+            "limit": POLL_BATCH_SIZE,
+            "timeout": POLL_TIMEOUT,
+            "allowed_updates": ["message", "callback_query"],
+        },
+        timeout=POLL_TIMEOUT + 10,
+    )
+    if not data or not data.get("ok"):
+        if data:
+            print(f"[polling] getUpdates failed: {data.get('description')}")
+        return None
+    return data["result"]
+
+
+def group_by_chat(updates):
+    """
+    {chat_id: [апдейты по порядку]} для разрешённых пользователей.
+    Апдейты без чата идут под ключом None.
+    """
+    groups = {}
+    for update in updates:
+        chat_id, user_id = main.update_ids(update)
+        if user_id is not None and user_id not in main.ALLOWED_USERS:
+            continue
+        groups.setdefault(chat_id, []).append(update)
+    return groups
+
+
+def process_updates(raw_updates):
+    """
+    Разобрать пачку: чаты параллельно, апдейты одного чата – подряд.
+    Возвращает чаты, чьи изменения не удалось сохранить.
+    """
+    updates = [telebot.types.Update.de_json(raw) for raw in raw_updates]
+    futures = []  # [(chat_id, future)]
+    for chat_id, chat_updates in group_by_chat(updates).items():
+        if chat_id is None:
+            for update in chat_updates:
+                futures.append((None, _pool.submit(main.process_update, update, None)))
+        else:
+            futures.append((chat_id, _pool.submit(main.process_batch, chat_id, chat_updates)))
+    unsaved = []
+    for chat_id, future in futures:
+        try:
+            saved = future.result()
+        except Exception as e:
+            print(f"[polling] batch failed: {e}")
+            saved = chat_id is None or main.flush_chat(chat_id)
+        if saved is False:
+            unsaved.append(chat_id)
+    return unsaved
+
+
+def run():
+    # getUpdates не работает, пока у бота установлен вебхук
+    tg_request("deleteWebhook", {})
+    offset = None
+    print(f"[polling] started (batch {POLL_BATCH_SIZE}, {POLL_WORKERS} workers)")
+    while True:
+        raw_updates = fetch_updates(offset)
+        if raw_updates is None:
+            time.sleep(POLL_ERROR_DELAY)
+            continue
+        if not raw_updates:
+            continue
+        started = time.monotonic()
+        unsaved = process_updates(raw_updates)
+        while unsaved:
+            # offset двигаем только после сохранения: повторно разбирать
+            # пачку нельзя (изменения уже в памяти), поэтому дожимаем запись
+            print(f"[polling] unsaved changes for chats {unsaved}, retrying save")
+            time.sleep(POLL_ERROR_DELAY)
+            unsaved = [chat_id for chat_id in unsaved if not main.flush_chat(chat_id)]
+        offset = raw_updates[-1]["update_id"] + 1
+        print(f"[polling] {len(raw_updates)} updates in {time.monotonic() - started:.2f} s")
+
+
+if __name__ == "__main__":
+    try:
+        run()
+    except KeyboardInterrupt:
+        write_behind.drain()
@@ -0,0 +1,31 @@
+"""
+Кэш отрисованных списков.
+
+Текст списка зависит только от данных раздела, поэтому хранится по ключу
+(вид, chat, section, parent_index) вместе с версией раздела
+(UserData.version). Слой мутаций (mutations.apply) и функции задач
+storage меняют версию затронутых разделов – следующий показ отрисует
+список заново, а повторные нажатия одной и той же кнопки меню берут
+готовый текст.
+
+Вид отличает разные отрисовки одного раздела: "list" (send_section
+в main.py), "inbox" (bot/inbox.py), "today" (bot/today.py).
+"""
+
+import os
+
+from cache import VersionedCache
+from storage import CONTEXT_TTL
+
+RENDER_CACHE_MAX = int(os.environ.get("RENDER_CACHE_MAX", "2000"))
+
+render_cache = VersionedCache(maxsize=RENDER_CACHE_MAX, ttl=CONTEXT_TTL)
+
+
+def cached(view, chat_id, section, parent_index, version, render):
+    """
+    Результат render() для этого вида списка, пока версия данных та же.
+    version – любое сравнимое значение: номер версии раздела или кортеж
+    версий, если отрисовка читает несколько разделов.
+    """
+    return render_cache.get_or_build((view, chat_id, section, parent_index), version, render)
@@ -0,0 +1,332 @@
+"""
+Формат файлов разделов: JSON (по умолчанию) или двоичный msgpack.
+
+STORAGE_FORMAT=msgpack – разделы пишутся в msgpack: кодируется и читается
+быстрее JSON с отступами и заметно короче (кириллица в JSON занимает те же
+2 байта, но отступы, кавычки ключей и разделители – нет). Файлы остаются
+с прежними именами (tasks.json и т.д.) – формат определяется по первым
+байтам при чтении, поэтому старые JSON-файлы и новые двоичные читаются
+одинаково и переходить можно постепенно (см. migrate_format.py).
+
+Двоичный файл начинается с MAGIC: байт 0xc1 в msgpack не используется,
+а в UTF-8 (и значит в JSON) не встречается вовсе – спутать нельзя.
+
+Кодирование – через пакет msgpack, если он установлен (C-расширение);
+без него – встроенная реализация на Python того же формата (медленнее,
+но файлы читаются и пишутся на любом воркере).
+
+Поверх любого формата – необязательное сжатие (STORAGE_COMPRESS=zlib или
+zstd, если установлен пакет zstandard). Сжатый файл тоже начинается
+со своего заголовка на 0xc1 и распаковывается при чтении сам; файлы меньше
+STORAGE_COMPRESS_MIN_KB не сжимаются – там выигрыш не стоит времени.
+Сжатие идёт потоком, так что большие JSON-разделы по-прежнему не
+собираются в памяти целиком.
+"""
+
+import itertools
+import os
+import struct
+import zlib
+
+import json_stream
+from nodes import Node, json_default
+
+try:
+    import msgpack
+except ImportError:  # необязательная зависимость
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # необязательная зависимость
+    zstandard = None
+
+FORMAT = os.environ.get("STORAGE_FORMAT", "json")
+FORMATS = ("json", "msgpack")
+
+MAGIC = b"\xc1MP\x01"
+
+COMPRESS = os.environ.get("STORAGE_COMPRESS", "")
+COMPRESS_MIN = int(float(os.environ.get("STORAGE_COMPRESS_MIN_KB", "32")) * 1024)
+ZLIB_MAGIC = b"\xc1ZL\x01"
+ZSTD_MAGIC = b"\xc1ZS\x01"
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+if COMPRESS == "zstd" and zstandard is None:
+    print("[section_format] zstandard is not installed, compressing with zlib")
+    COMPRESS = "zlib"
+
+
+def encode(obj, fmt=None, compact=False, compress=None) -> bytes:
+    """
+    Тело файла раздела в формате fmt (по умолчанию – STORAGE_FORMAT),
+    сжатое по правилам compress_chunks (compress=None – STORAGE_COMPRESS).
+    """
+    fmt = fmt or FORMAT
+    if fmt == "msgpack":
+        chunks = [MAGIC + packb(obj)]
+    elif fmt == "json":
+        chunks = json_stream.encode_chunks(obj, compact=compact)
+    else:
+        raise ValueError(f"unknown section format: {fmt}")
+    return b"".join(compress_chunks(chunks, compress))
+
+
+def detect(head: bytes) -> str:
+    """Формат по первым байтам файла (уже распакованного)."""
+    return "msgpack" if head.startswith(MAGIC) else "json"
+
+
+def _peek(chunks, size):
+    """(первые size байт или всё, что есть; итератор оставшихся кусков)."""
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= size:
+            break
+    return head, chunks
+
+
+def load(chunks, item_hook=None):
+    """
+    Разобрать файл из кусков байтов в любом из форматов (сжатый –
+    распаковывается по ходу). JSON разбирается потоком (json_stream.load),
+    двоичный – целиком.
+    """
+    head, chunks = _peek(decompress_chunks(chunks), len(MAGIC))
+    if detect(head) == "json":
+        return json_stream.load(itertools.chain([head], chunks), item_hook)
+    obj = unpackb(b"".join(itertools.chain([head], chunks))[len(MAGIC):])
+    if item_hook is not None and isinstance(obj, list):
+        return [item_hook(item) for item in obj]
+    return obj
+
+
+def decode(body: bytes, item_hook=None):
+    """load для тела, уже лежащего в памяти."""
+    return load([body], item_hook)
+
+
+# ====== сжатие ======
+
+def compress_chunks(chunks, method=None, min_size=None):
+    """
+    Куски файла -> куски сжатого файла (заголовок + поток zlib/zstd).
+    Пока набрано меньше min_size байт, куски копятся: если файл на этом
+    кончился, он уходит несжатым. method="" – без сжатия.
+    """
+    method = COMPRESS if method is None else method
+    min_size = COMPRESS_MIN if min_size is None else min_size
+    if not method:
+        yield from chunks
+        return
+    chunks = iter(chunks)
+    head, size = [], 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            break
+    else:
+        yield b"".join(head)
+        return
+    if method == "zstd":
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        yield ZSTD_MAGIC
+    elif method == "zlib":
+        compressor = zlib.compressobj(ZLIB_LEVEL)
+        yield ZLIB_MAGIC
+    else:
+        raise ValueError(f"unknown compression: {method}")
+    for chunk in itertools.chain(head, chunks):
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def decompress_chunks(chunks):
+    """Куски файла -> куски распакованного файла (несжатый – как есть)."""
+    head, chunks = _peek(chunks, len(ZLIB_MAGIC))
+    if head.startswith(ZLIB_MAGIC):
+        decompressor = zlib.decompressobj()
+    elif head.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("file is zstd-compressed, but zstandard is not installed")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+        if head:
+            yield head
+        yield from chunks
+        return
+    head = head[len(ZLIB_MAGIC):]
+    for chunk in itertools.chain([head], chunks):
+        out = decompressor.decompress(chunk)
+        if out:
+            yield out
+    if not decompressor.eof:
+        raise ValueError("truncated compressed stream")
+
+
+# ====== msgpack ======
+
+def packb(obj) -> bytes:
+    if msgpack is not None:
+        return msgpack.packb(obj, default=json_default, use_bin_type=True)
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+def unpackb(body):
+    if msgpack is not None:
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    obj, pos = _unpack(memoryview(body), 0)
+    if pos != len(body):
+        raise ValueError("extra data after msgpack object")
+    return obj
+
+
+# Встроенная реализация: nil, bool, int, float, str, bin, array, map –
+# всё, что бывает в разделах.
+
+def _pack(obj, out):
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -32 <= obj < 0:
+            out.append(obj & 0xff)
+        else:
+            out += _pack_int(obj)
+    elif isinstance(obj, float):
+        out += struct.pack(">Bd", 0xcb, obj)
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8")
+        n = len(data)
+        if n < 32:
+            out.append(0xa0 | n)
+        elif n < 0x100:
+            out += struct.pack(">BB", 0xd9, n)
+        elif n < 0x10000:
+            out += struct.pack(">BH", 0xda, n)
+        else:
+            out += struct.pack(">BI", 0xdb, n)
+        out += data
+    elif isinstance(obj, (bytes, bytearray)):
+        n = len(obj)
+        out += struct.pack(">BB", 0xc4, n) if n < 0x100 else struct.pack(">BI", 0xc6, n)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        n = len(obj)
+        if n < 16:
+            out.append(0x90 | n)
+        elif n < 0x10000:
+            out += struct.pack(">BH", 0xdc, n)
+        else:
+            out += struct.pack(">BI", 0xdd, n)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        n = len(obj)
+        if n < 16:
+            out.append(0x80 | n)
+        elif n < 0x10000:
+            out += struct.pack(">BH", 0xde, n)
+        else:
+            out += struct.pack(">BI", 0xdf, n)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    elif isinstance(obj, Node):
+        _pack(obj.to_json(), out)
+    else:
+        raise TypeError(f"Object of type {type(obj).__name__} is not msgpack serializable")
+
+
+def _pack_int(value) -> bytes:
+    if value >= 0:
+        for code, fmt, limit in ((0xcc, ">BB", 2 ** 8), (0xcd, ">BH", 2 ** 16),
+                                 (0xce, ">BI", 2 ** 32), (0xcf, ">BQ", 2 ** 64)):
+            if value < limit:
+                return struct.pack(fmt, code, value)
+    else:
+        for code, fmt, limit in ((0xd0, ">Bb", 2 ** 7), (0xd1, ">Bh", 2 ** 15),
+                                 (0xd2, ">Bi", 2 ** 31), (0xd3, ">Bq", 2 ** 63)):
+            if value >= -limit:
+                return struct.pack(fmt, code, value)
+    raise OverflowError("integer out of msgpack range")
+
+
+# Коды с длиной/значением фиксированного размера: код -> (формат struct, размер)
+_FIXED = {
+    0xcc: (">B", 1), 0xcd: (">H", 2), 0xce: (">I", 4), 0xcf: (">Q", 8),
+    0xd0: (">b", 1), 0xd1: (">h", 2), 0xd2: (">i", 4), 0xd3: (">q", 8),
+    0xca: (">f", 4), 0xcb: (">d", 8),
+}
+_STR = {0xd9: (">B", 1), 0xda: (">H", 2), 0xdb: (">I", 4)}
+_BIN = {0xc4: (">B", 1), 0xc5: (">H", 2), 0xc6: (">I", 4)}
+_ARRAY = {0xdc: (">H", 2), 0xdd: (">I", 4)}
+_MAP = {0xde: (">H", 2), 0xdf: (">I", 4)}
+
+
+def _unpack(buf, pos):
+    code = buf[pos]
+    pos += 1
+    if code < 0x80:
+        return code, pos
+    if code >= 0xe0:
+        return code - 0x100, pos
+    if 0xa0 <= code <= 0xbf:
+        n = code & 0x1f
+        return str(buf[pos:pos + n], "utf-8"), pos + n
+    if 0x90 <= code <= 0x9f:
+        return _unpack_array(buf, pos, code & 0x0f)
+    if 0x80 <= code <= 0x8f:
+        return _unpack_map(buf, pos, code & 0x0f)
+    if code == 0xc0:
+        return None, pos
+    if code == 0xc2:
+        return False, pos
+    if code == 0xc3:
+        return True, pos
+    if code in _FIXED:
+        fmt, size = _FIXED[code]
+        return struct.unpack_from(fmt, buf, pos)[0], pos + size
+    for table, build in ((_STR, "str"), (_BIN, "bin"), (_ARRAY, "array"), (_MAP, "map")):
+        if code in table:
+            fmt, size = table[code]
+            n = struct.unpack_from(fmt, buf, pos)[0]
+            pos += size
+            if build == "str":
+                return str(buf[pos:pos + n], "utf-8"), pos + n
+            if build == "bin":
+                return bytes(buf[pos:pos + n]), pos + n
+            if build == "array":
+                return _unpack_array(buf, pos, n)
+            return _unpack_map(buf, pos, n)
+    raise ValueError(f"unsupported msgpack code 0x{code:02x}")
+
+
+def _unpack_array(buf, pos, n):
+    items = []
+    for _ in range(n):
+        item, pos = _unpack(buf, pos)
+        items.append(item)
+    return items, pos
+
+
+def _unpack_map(buf, pos, n):
+    result = {}
+    for _ in range(n):
+        key, pos = _unpack(buf, pos)
+        value, pos = _unpack(buf, pos)
+        result[key] = value
+    return result, pos
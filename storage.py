@@ -1,23 +1,431 @@
 import os
 import json
+import time
+import asyncio
+import hashlib
+import contextlib
+import datetime
+import itertools
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 
 import dropbox
-from dropbox.files import WriteMode
+from dropbox.files import WriteMode, UploadSessionCursor, CommitInfo
 from dropbox.exceptions import ApiError
 
+import disk_cache
+import json_stream
+import mutations
+import section_format
+from nodes import Node, from_json_list, max_id, dumps as dumps_nodes
+
 # Бот в main.py импортирует это имя – оставляем.
 tasks_by_user = {}
 
-# Токен Dropbox берём из переменной окружения DROPBOX_TOKEN (Render → Environment)
-DROPBOX_TOKEN = os.environ["DROPBOX_TOKEN"]
+# Где храним данные: "dropbox" (по умолчанию) или "sqlite" – локальная
+# база без сети (см. storage_sqlite.py).
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "dropbox")
+
+# Клиент Dropbox создаём при первом обращении, чтобы модуль импортировался
+# и без DROPBOX_TOKEN (например, с STORAGE_BACKEND=sqlite).
+_dbx_client = None
+
+
+def _dbx():
+    """
+    Клиент Dropbox. Токен берём из переменной окружения DROPBOX_TOKEN
+    (Render → Environment).
+    """
+    global _dbx_client
+    if _dbx_client is None:
+        _dbx_client = dropbox.Dropbox(os.environ["DROPBOX_TOKEN"])
+    return _dbx_client
 
-# Клиент Dropbox
-dbx = dropbox.Dropbox(DROPBOX_TOKEN)
 
 # Если файлы лежат в корне Dropbox – оставь пустую строку.
 # Если они в папке (например, /planner), впиши FOLDER = "/planner"
 FOLDER = "/smart-planner"
 
+# У каждого пользователя своя папка USERS_FOLDER/<user_id> внутри FOLDER,
+# а список пользователей – в реестре USERS_FILE (см. register_user).
+# Файлы, лежащие прямо в FOLDER (так было до разделения), остаются
+# за STORAGE_LEGACY_USER; если он не задан – за первым пользователем,
+# которого увидит реестр.
+USERS_FOLDER = "users"
+USERS_FILE = "users.json"
+LEGACY_USER = os.environ.get("STORAGE_LEGACY_USER", "")
+
+# Параллельная загрузка разделов при холодном старте:
+# сколько файлов качаем одновременно и сколько ждём каждый (секунды).
+LOAD_WORKERS = int(os.environ.get("STORAGE_LOAD_WORKERS", "7"))
+LOAD_TIMEOUT = float(os.environ.get("STORAGE_LOAD_TIMEOUT", "15"))
+
+_load_pool = ThreadPoolExecutor(max_workers=LOAD_WORKERS, thread_name_prefix="dbx-load")
+
+# Ленивая загрузка (STORAGE_LAZY_LOAD=1): load_data не ждёт все разделы,
+# раздел читается из бэкенда при первом обращении. С STORAGE_PREFETCH=1
+# остальные разделы сразу качаются в фоне, и к следующему обращению
+# обычно уже готовы. Первый ответ после холодного старта ждёт один файл.
+LAZY_LOAD = os.environ.get("STORAGE_LAZY_LOAD", "1") == "1"
+PREFETCH = os.environ.get("STORAGE_PREFETCH", "1") == "1"
+
+# Раскладка хранения в Dropbox:
+#   "files"  – каждый раздел в своём файле (tasks.json, today.json, ...);
+#   "bundle" – все разделы в одном файле-снимке BUNDLE_FILE (1 запрос вместо 7).
+# Переключение в обе стороны прозрачное – см. load_data.
+STORAGE_LAYOUT = os.environ.get("STORAGE_LAYOUT", "files")
+BUNDLE_FILE = "snapshot.bundle"
+BUNDLE_VERSION = 1
+
+# Режим журнала (STORAGE_JOURNAL=1): каждое изменение из main.py (add/edit/
+# mv/del/undo) дописывается в журнал компактной записью, а не переписывает
+# разделы. Раз в JOURNAL_COMPACT_EVERY записей журнал сворачивается в снимок
+# разделов. При загрузке к снимку применяется хвост журнала – заодно
+# восстанавливается и стек undo.
+JOURNAL = os.environ.get("STORAGE_JOURNAL", "0") == "1"
+JOURNAL_COMPACT_EVERY = int(os.environ.get("JOURNAL_COMPACT_EVERY", "100"))
+JOURNAL_FOLDER = "journal"
+JOURNAL_MARK = f"{JOURNAL_FOLDER}/mark.json"
+
+# Контекст списков (какой раздел показан в сообщении бота) храним вместе
+# с данными пользователя, чтобы ответы /add, /edit, /mv, /del работали
+# и после рестарта. Запись живёт CONTEXT_TTL секунд, на пользователя
+# храним не больше CONTEXT_KEEP последних.
+CONTEXTS_FILE = "contexts.json"
+CONTEXT_TTL = int(os.environ.get("CONTEXT_TTL_HOURS", "168")) * 3600
+CONTEXT_KEEP = int(os.environ.get("CONTEXT_KEEP", "500"))
+
+# Что лежит в Dropbox по нашим сведениям: {путь: (content_hash, rev)}.
+# Обновляется при каждом скачивании и заливке; если хеш новых данных
+# совпадает с сохранённым – заливку пропускаем.
+_remote_meta = {}
+
+# STORAGE_CONDITIONAL_WRITES=1 – писать с WriteMode.update(rev): если файл
+# в Dropbox успел поменять кто-то ещё (другой воркер, приложение Dropbox),
+# не затираем его, а кладём нашу версию рядом конфликтной копией
+# и перечитываем раздел из Dropbox (см. _reconcile).
+CONDITIONAL_WRITES = os.environ.get("STORAGE_CONDITIONAL_WRITES", "0") == "1"
+
+# Файлы разделов читаются и пишутся потоком (json_stream.py): ответ
+# разбирается по мере скачивания, а документ больше STREAM_THRESHOLD_MB
+# заливается сессией загрузки Dropbox кусками – память не растёт вместе
+# с размером раздела. STORAGE_JSON_COMPACT=1 – писать JSON без отступов.
+STREAM_THRESHOLD = int(float(os.environ.get("STORAGE_STREAM_THRESHOLD_MB", "8")) * 1024 * 1024)
+JSON_COMPACT = os.environ.get("STORAGE_JSON_COMPACT", "0") == "1"
+
+# Раздел -> файл в Dropbox, в котором он хранится.
+SECTION_FILES = {
+    "inbox": "tasks.json",
+    "today": "today.json",
+    "routines": "routines.json",
+    "templates": "templates.json",
+    "projects": "projects.json",
+    "habits": "habits.json",
+    "sos": "sos.json",
+}
+_SECTION_FILENAMES = frozenset(SECTION_FILES.values())
+
+
+# Раздел не скачался (ошибка Dropbox, таймаут) – в отличие от "файла нет",
+# это не пустой раздел: такой раздел не считается загруженным и не
+# сохраняется, пока не скачается (см. load_data и UserData._load).
+LOAD_FAILED = object()
+
+
+class SectionLoadError(Exception):
+    """Раздел не удалось скачать – повторим при следующем обращении."""
+
+
+# Номера версий разделов – общие для всех UserData, так что версия не
+# повторяется и после перезагрузки данных пользователя (см. UserData.version)
+_versions = itertools.count(1)
+
+
+class UserData(dict):
+    """
+    Данные пользователя: {раздел: список элементов (nodes.Node)}.
+    Дополнительно помнит, какие разделы менялись с последнего сохранения,
+    чтобы save_data заливал в Dropbox только их, и держит индекс
+    id -> (раздел, id родителя, элемент) по всем элементам.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # Версии разделов для кэша отрисовки: {section: номер} (см. touch)
+        self._versions = {}
+        # Ещё не загруженные разделы: {section: Future или None} (см. UserData.lazy)
+        self._pending = {}
+        self._loader = None
+        self._load_lock = threading.RLock()
+        super().__init__(*args, **kwargs)
+        # Сырые списки (JSON, шаблоны по умолчанию) превращаем в узлы
+        for section, items in list(self.items()):
+            super().__setitem__(section, from_json_list(items))
+        self.dirty = set()
+        # Индекс элементов: {id: (section, parent_id, node)}.
+        # Обновляется слоем мутаций (mutations.py) и функциями задач ниже.
+        # Дети, ещё не разобранные из JSON (Node.children_loaded), попадают
+        # в индекс при первом промахе find – тогда индексируется всё.
+        self.index = {}
+        self.last_id = 0
+        self._fully_indexed = False
+        self._build_index()
+        # Стек действий для /undo (см. mutations.apply)
+        self.undo = []
+        # Журнал: записи, ещё не отправленные в бэкенд, – [(seq, json)],
+        # номер последней записи, число записей после свёртки
+        # и разделы, изменённые этими записями.
+        self.pending_ops = []
+        self.journal_seq = 0
+        self.ops_since_compaction = 0
+        self.journal_sections = set()
+        # Контекст списков: {message_id: [section, parent_index, expires_at]}
+        # (загружается в фоне: см. contexts и load_data)
+        self._contexts = {}
+        self._contexts_future = None
+        self.contexts_dirty = False
+        # Файлы, которые сейчас заливаются: {файл: сколько записей} (см. save_data)
+        self.saving = Counter()
+
+    def __setitem__(self, section, value):
+        self._pending.pop(section, None)
+        super().__setitem__(section, value)
+        self.dirty.add(section)
+        self.touch(section)
+
+    def touch(self, *sections):
+        """Разделы изменились в памяти – отрисовки со старой версией устарели."""
+        for section in sections:
+            self._versions[section] = next(_versions)
+
+    def version(self, section) -> int:
+        """Текущая версия раздела (меняется при каждом touch)."""
+        number = self._versions.get(section)
+        if number is None:
+            number = self._versions.setdefault(section, next(_versions))
+        return number
+
+    def mark_dirty(self, *sections):
+        """
+        Отметить разделы как изменённые.
+        Без аргументов – отметить все разделы.
+        """
+        self.dirty.update(sections or SECTION_FILES)
+
+    def _build_index(self):
+        """
+        Построить индекс. Элементам без id (старые файлы) выдаём новый
+        и помечаем раздел изменённым, чтобы id сохранились.
+        """
+        self.last_id = max_id(node for items in self.values() for node in items)
+        for section, items in self.items():
+            self._index_section(section, items)
+
+    def _index_section(self, section, items):
+        for node in items:
+            if self.index_node(section, None, node):
+                self.dirty.add(section)
+
+    # --- ленивая загрузка разделов ---
+
+    @classmethod
+    def lazy(cls, load_section, sections, prefetch=PREFETCH):
+        """
+        Данные, которые читают раздел через load_section(section) -> список
+        при первом обращении. С prefetch все разделы сразу ставятся
+        на загрузку в фоне (_load_pool).
+        """
+        data = cls()
+        data._loader = load_section
+        for section in sections:
+            data._pending[section] = _load_pool.submit(load_section, section) if prefetch else None
+        return data
+
+    def _load(self, section):
+        with self._load_lock:
+            if section not in self._pending:
+                return  # уже загрузил другой поток
+            future = self._pending[section]
+            try:
+                if future is None:
+                    raw = self._loader(section)
+                else:
+                    raw = future.result(timeout=LOAD_TIMEOUT)
+            except FutureTimeout:
+                # Файл есть, просто не успел скачаться: пустой список на его
+                # месте затёр бы файл при следующем сохранении
+                print(f"[storage] section load timeout for {section} ({LOAD_TIMEOUT:.0f} s)")
+                self._pending[section] = None
+                raise SectionLoadError(section)
+            except Exception:
+                # Следующее обращение попробует ещё раз
+                self._pending[section] = None
+                raise
+            del self._pending[section]
+            items = from_json_list(raw)
+            super().__setitem__(section, items)
+            self.last_id = max(self.last_id, max_id(items))
+            self._index_section(section, items)
+
+    def load_all(self):
+        """Дождаться всех ещё не загруженных разделов (качаются параллельно)."""
+        with self._load_lock:
+            for section, future in self._pending.items():
+                if future is None:
+                    self._pending[section] = _load_pool.submit(self._loader, section)
+        for section in list(self._pending):
+            self._load(section)
+
+    @property
+    def loaded(self) -> bool:
+        return not self._pending
+
+    def replace_section(self, section, raw):
+        """
+        Подменить раздел версией из бэкенда (файл изменили извне, см.
+        change_feed.py). Раздел не становится dirty, индекс и версия
+        обновляются, а действия undo по этому разделу забываются –
+        их позиции относятся к старому списку.
+        """
+        with self._load_lock:
+            self._pending.pop(section, None)
+            for node in super().get(section, []):
+                self.unindex_node(node)
+            items = from_json_list(raw)
+            super().__setitem__(section, items)
+            self.last_id = max(self.last_id, max_id(items))
+            self._index_section(section, items)
+        self.undo = [action for action in self.undo
+                     if section not in mutations.touched_sections(action)]
+        self.touch(section)
+
+    def __getitem__(self, section):
+        if section in self._pending:
+            self._load(section)
+        return super().__getitem__(section)
+
+    def get(self, section, default=None):
+        if section in self._pending:
+            self._load(section)
+        return super().get(section, default)
+
+    def __contains__(self, section):
+        return section in self._pending or super().__contains__(section)
+
+    # Перебор всех разделов (индекс, отладка) сначала дозагружает их
+    def keys(self):
+        self.load_all()
+        return super().keys()
+
+    def values(self):
+        self.load_all()
+        return super().values()
+
+    def items(self):
+        self.load_all()
+        return super().items()
+
+    def __iter__(self):
+        self.load_all()
+        return super().__iter__()
+
+    def __len__(self):
+        return super().__len__() + len(self._pending)
+
+    def new_id(self) -> int:
+        # id уникальны во всех разделах – выдаём, только зная все разделы
+        self.load_all()
+        self.last_id += 1
+        return self.last_id
+
+    def index_node(self, section, parent_id, node) -> bool:
+        """
+        Занести элемент вместе с детьми в индекс (или обновить его раздел
+        и родителя). Без id или с чужим id – выдаём новый; тогда True.
+        """
+        assigned = False
+        node_id = node.id
+        known = self.index.get(node_id)
+        if not isinstance(node_id, int) or (known is not None and known[2] is not node):
+            node.id = node_id = self.new_id()
+            assigned = True
+        elif node_id > self.last_id:
+            self.last_id = node_id
+        self.index[node_id] = (section, parent_id, node)
+        if node.children_loaded or self._fully_indexed:
+            for child in node.children:
+                assigned |= self.index_node(section, node_id, child)
+        return assigned
+
+    def unindex_node(self, node):
+        """Убрать элемент вместе с детьми из индекса."""
+        self.index.pop(node.id, None)
+        if node.children_loaded:
+            for child in node.children:
+                self.unindex_node(child)
+
+    def _index_all(self):
+        """Разобрать всех ещё сырых детей и занести их в индекс."""
+        self._fully_indexed = True
+        for section, items in self.items():
+            self._index_section(section, items)
+
+    def find(self, item_id):
+        """(section, parent_id, node) по id или None."""
+        entry = self.index.get(item_id)
+        if entry is None and not self._fully_indexed:
+            self._index_all()
+            entry = self.index.get(item_id)
+        return entry
+
+    def container(self, item_id):
+        """Список, в котором лежит элемент (раздел или children родителя)."""
+        section, parent_id, _ = self.index[item_id]
+        if parent_id is None:
+            return self[section]
+        return self.index[parent_id][2].children
+
+    @property
+    def contexts(self):
+        with self._load_lock:
+            if self._contexts_future is not None:
+                future, self._contexts_future = self._contexts_future, None
+                try:
+                    contexts = future.result(timeout=LOAD_TIMEOUT)
+                except Exception as e:
+                    print(f"[storage] contexts load error: {e}")
+                    contexts = {}
+                # В JSON ключи – строки, а message_id – число
+                self._contexts = {int(mid): entry for mid, entry in contexts.items()}
+            return self._contexts
+
+    @contexts.setter
+    def contexts(self, value):
+        with self._load_lock:
+            self._contexts_future = None
+            self._contexts = value
+
+    def remember_context(self, message_id, section, parent_index):
+        """Запомнить, какой список показан в сообщении message_id."""
+        self.contexts[message_id] = [section, parent_index, int(time.time()) + CONTEXT_TTL]
+        self.contexts_dirty = True
+
+    def get_context(self, message_id):
+        """(section, parent_index) для сообщения или None, если не знаем/истёк."""
+        entry = self.contexts.get(message_id)
+        if entry is None or entry[2] <= time.time():
+            return None
+        return entry[0], entry[1]
+
+    def live_contexts(self) -> dict:
+        """Неистёкшие записи контекста, не больше CONTEXT_KEEP самых свежих."""
+        now = time.time()
+        alive = sorted(
+            ((mid, entry) for mid, entry in self.contexts.items() if entry[2] > now),
+            key=lambda pair: pair[1][2],
+        )
+        return dict(alive[-CONTEXT_KEEP:])
+
 
 def _path(filename: str) -> str:
     """
@@ -28,88 +436,1326 @@ def _path(filename: str) -> str:
     return f"/{filename}"
 
 
-def _download_json(filename: str, default):
+def _download_json(filename: str, default, item_hook=None, revs=None, on_error=None):
     """
-    Скачиваем JSON из Dropbox.
-    Если файла нет – возвращаем default.
+    Скачиваем JSON из Dropbox и разбираем его по мере скачивания
+    (item_hook – для каждого элемента массива, см. json_stream.load).
+    Файл раздела может быть и двоичным – формат определяется по первым
+    байтам (section_format.load).
+    Если файла нет – возвращаем default. Если не скачался или не
+    разобрался – on_error (по умолчанию тоже default; разделы передают
+    LOAD_FAILED, чтобы пустой список не затёр файл при сохранении).
+
+    revs – ревизии файлов папки (_list_revs): файла в ней нет – сразу
+    default, ревизия совпала с локальным кэшем (STORAGE_CACHE_DIR) –
+    читаем с диска без запроса к Dropbox.
     """
+    path = _path(filename)
+    if revs is not None:
+        remote = revs.get(filename.rsplit("/", 1)[-1])
+        if remote is None:
+            return default
+        _remote_meta[path] = remote
+        cached = disk_cache.get(path, remote[1])
+        if cached is not None:
+            try:
+                return section_format.load(cached, item_hook)
+            except Exception as e:
+                print(f"[storage] disk cache error for {filename}: {e}")
     try:
-        _, res = dbx.files_download(_path(filename))
-        data = res.content.decode("utf-8")
-        return json.loads(data)
+        md, res = _dbx().files_download(path)
+        _remote_meta[path] = (md.content_hash, md.rev)
+        chunks = res.iter_content(json_stream.READ_CHUNK_SIZE)
+        if disk_cache.ENABLED and _cacheable(filename):
+            chunks = disk_cache.Tee(path, chunks)
+        try:
+            result = section_format.load(chunks, item_hook)
+        except Exception:
+            if isinstance(chunks, disk_cache.Tee):
+                chunks.discard()
+            raise
+        finally:
+            res.close()
+        if isinstance(chunks, disk_cache.Tee):
+            chunks.commit(md.rev)
+        return result
     except ApiError as e:
         print(f"[storage] Dropbox download error for {filename}: {e}")
-        return default
+        if _is_not_found(e):
+            return default
+        return default if on_error is None else on_error
     except Exception as e:
         print(f"[storage] JSON parse error for {filename}: {e}")
-        return default
+        return default if on_error is None else on_error
+
+
+def _download_many(filenames, default, item_hook=None, revs=None, on_error=None):
+    """
+    Скачиваем несколько JSON-файлов параллельно и возвращаем {filename: data}.
+    Если файла нет – для него default, если не скачался или не уложился
+    в LOAD_TIMEOUT – on_error, как и в _download_json.
+    """
+    futures = {
+        name: _load_pool.submit(_download_json, name, default, item_hook, revs, on_error)
+        for name in filenames
+    }
+    result = {}
+    for name, future in futures.items():
+        try:
+            result[name] = future.result(timeout=LOAD_TIMEOUT)
+        except FutureTimeout:
+            print(f"[storage] Dropbox download timeout for {name} ({LOAD_TIMEOUT:.0f} s)")
+            result[name] = default if on_error is None else on_error
+    return result
+
 
+def _cacheable(filename: str) -> bool:
+    """Файлы, которые держим в локальном кэше: файлы разделов."""
+    return filename.rsplit("/", 1)[-1] in _SECTION_FILENAMES
 
-def _upload_json(filename: str, data):
+
+def _list_revs(base=""):
+    """
+    {имя файла: (content_hash, rev)} для папки пользователя – одним
+    запросом list_folder (с продолжениями). Папки нет – пустой словарь,
+    ошибка Dropbox – None (тогда файлы качаются как обычно).
+    """
+    folder = _path(base.rstrip("/")) if base else FOLDER.rstrip("/")
+    try:
+        res = _dbx().files_list_folder(folder)
+        entries = list(res.entries)
+        while res.has_more:
+            res = _dbx().files_list_folder_continue(res.cursor)
+            entries.extend(res.entries)
+    except ApiError as e:
+        if _is_not_found(e):
+            return {}
+        print(f"[storage] Dropbox list_folder error for {folder}: {e}")
+        return None
+    # У папок нет rev – пропускаем их
+    return {
+        entry.name: (entry.content_hash, entry.rev)
+        for entry in entries
+        if getattr(entry, "rev", None)
+    }
+
+
+def _upload_json(filename: str, data, compress=None):
     """
     Загружаем JSON в Dropbox, перезаписывая файл.
+    Документ кодируется (и при STORAGE_COMPRESS сжимается) кусками:
+    небольшой уходит одним запросом (_upload_body), больше
+    STREAM_THRESHOLD – сессией загрузки (_upload_stream), не собираясь
+    в памяти целиком.
+    True – случился конфликт (см. _upload_body).
     """
-    body = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
-    dbx.files_upload(body, _path(filename), mode=WriteMode("overwrite"))
+    path = _path(filename)
+    encode = lambda: section_format.compress_chunks(
+        json_stream.encode_chunks(data, compact=JSON_COMPACT), compress)
+    chunks = encode()
+    head, size = [], 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size > STREAM_THRESHOLD:
+            break
+    else:
+        return _upload_body(path, b"".join(head))
+    return _upload_stream(path, itertools.chain(head, chunks), encode)
 
 
-def _normalize_list(raw):
+def _upload_section(filename: str, items, fmt=None, compress=None):
     """
-    Приводим старый формат к новому:
-    - строка -> {"title": строка, "children": []}
-    - dict -> гарантируем наличие полей title и children
+    Загружаем файл раздела в формате STORAGE_FORMAT (или fmt) со сжатием
+    STORAGE_COMPRESS (или compress): JSON – потоком через _upload_json,
+    двоичный – одним телом. True – случился конфликт (см. _upload_body).
     """
-    result = []
-    if not raw:
-        return result
+    fmt = fmt or section_format.FORMAT
+    if fmt == "json":
+        return _upload_json(filename, items, compress)
+    return _upload_encoded(_path(filename), section_format.encode(items, fmt, compress=compress))
 
-    for item in raw:
-        if isinstance(item, str):
-            result.append({"title": item, "children": []})
-        elif isinstance(item, dict):
-            title = item.get("title") or item.get("text") or str(item)
-            children = item.get("children") or []
-            if not isinstance(children, list):
-                children = []
-            result.append({"title": title, "children": children})
-        else:
-            result.append({"title": str(item), "children": []})
+
+def _upload_encoded(path: str, body: bytes):
+    """
+    Заливаем уже закодированный файл: небольшой – одним запросом
+    (_upload_body), больше STREAM_THRESHOLD – сессией загрузки кусками.
+    True – случился конфликт (см. _upload_body).
+    """
+    if len(body) <= STREAM_THRESHOLD:
+        return _upload_body(path, body)
+    size = json_stream.CHUNK_SIZE
+    slices = lambda: (body[i:i + size] for i in range(0, len(body), size))
+    return _upload_stream(path, slices(), slices)
+
+
+def _content_hash(body: bytes) -> str:
+    """
+    Хеш в формате Dropbox content_hash: SHA-256 от склеенных
+    SHA-256 блоков по 4 МБ. Так его можно сравнивать с metadata.content_hash.
+    """
+    block = 4 * 1024 * 1024
+    digests = b"".join(
+        hashlib.sha256(body[i:i + block]).digest()
+        for i in range(0, len(body), block)
+    )
+    return hashlib.sha256(digests).hexdigest()
+
+
+def _upload_body(path: str, body: bytes):
+    """
+    Заливаем байты в Dropbox.
+    Если они совпадают с тем, что там уже лежит (по content_hash), – ничего не делаем.
+    Возвращает True, если файл в Dropbox оказался новее (конфликт): наша
+    версия тогда лежит рядом копией, а вызывающий должен перечитать файл
+    (см. DropboxBackend.save). До этого _remote_meta хранит прежнюю
+    ревизию, и следующие заливки тоже уходят в копии, а не поверх чужой
+    версии.
+    """
+    content_hash = _content_hash(body)
+    known = _remote_meta.get(path)
+    if known and known[0] == content_hash:
+        return False
+
+    if CONDITIONAL_WRITES and known:
+        mode = WriteMode.update(known[1])
+    else:
+        mode = WriteMode("overwrite")
+
+    try:
+        md = _dbx().files_upload(body, path, mode=mode)
+    except ApiError as e:
+        if not (CONDITIONAL_WRITES and known and _is_conflict(e)):
+            raise
+        # Файл в Dropbox новее, чем мы его видели, – оставляем его как есть,
+        # а свою версию кладём рядом (Dropbox сам подберёт имя "... (1).json").
+        md = _dbx().files_upload(body, path, mode=WriteMode("add"), autorename=True)
+        print(f"[storage] Dropbox conflict for {path}: saved as {md.path_display}")
+        return True
+    if disk_cache.ENABLED and _cacheable(path):
+        disk_cache.put(path, md.rev, body)
+    _remote_meta[path] = (md.content_hash, md.rev)
+    return False
+
+
+def _upload_stream(path: str, chunks, make_chunks):
+    """
+    Заливаем большой файл сессией загрузки Dropbox: куски уходят по одному.
+    make_chunks() даёт их заново – для повтора конфликтной копией.
+    Проверки content_hash до заливки нет (хеш известен только в конце),
+    но раздел и так сохраняется, только когда менялся.
+    True – случился конфликт (см. _upload_body).
+    """
+    known = _remote_meta.get(path)
+    if CONDITIONAL_WRITES and known:
+        mode = WriteMode.update(known[1])
+    else:
+        mode = WriteMode("overwrite")
+
+    if disk_cache.ENABLED and _cacheable(path):
+        chunks = disk_cache.Tee(path, chunks)
+    try:
+        md = _upload_session(path, chunks, mode)
+    except ApiError as e:
+        if isinstance(chunks, disk_cache.Tee):
+            chunks.discard()
+        if not (CONDITIONAL_WRITES and known and _is_conflict(e)):
+            raise
+        # Как в _upload_body: свою версию кладём рядом конфликтной копией
+        md = _upload_session(path, make_chunks(), WriteMode("add"), autorename=True)
+        print(f"[storage] Dropbox conflict for {path}: saved as {md.path_display}")
+        return True
+    if isinstance(chunks, disk_cache.Tee):
+        chunks.commit(md.rev)
+    _remote_meta[path] = (md.content_hash, md.rev)
+    return False
+
+
+def _upload_session(path, chunks, mode, autorename=False):
+    """Одна сессия загрузки: start, append на каждый кусок, finish."""
+    dbx = _dbx()
+    chunks = iter(chunks)
+    first = next(chunks, b"")
+    session_id = dbx.files_upload_session_start(first).session_id
+    offset = len(first)
+    for chunk in chunks:
+        dbx.files_upload_session_append_v2(chunk, UploadSessionCursor(session_id, offset))
+        offset += len(chunk)
+    return dbx.files_upload_session_finish(
+        b"",
+        UploadSessionCursor(session_id, offset),
+        CommitInfo(path=path, mode=mode, autorename=autorename),
+    )
+
+
+def _is_not_found(err: ApiError) -> bool:
+    """True, если Dropbox ответил, что файла нет (а не другой ошибкой)."""
+    error = getattr(err, "error", None)
+    try:
+        return error.is_path() and error.get_path().is_not_found()
+    except AttributeError:
+        return False
+
+
+def _is_conflict(err: ApiError) -> bool:
+    """True, если заливка с WriteMode.update упала из-за более новой версии файла."""
+    error = getattr(err, "error", None)
+    try:
+        if not error.is_path():
+            return False
+        # files_upload: UploadWriteFailed с reason, сессия загрузки: сразу WriteError
+        path_error = error.get_path()
+        return getattr(path_error, "reason", path_error).is_conflict()
+    except AttributeError:
+        return False
+
+
+# ====== SNAPSHOT (раскладка "bundle") ======
+
+def _encode_bundle(data) -> bytes:
+    """
+    Собираем снимок: первая строка – JSON-заголовок с версией схемы
+    и смещениями разделов, дальше – тела разделов подряд:
+
+        {"version": 1, "sections": {"inbox": [0, 120], "today": [120, 2], ...}}
+        [...inbox...][...today...]...
+
+    Смещение и длина – в байтах от начала тела (после перевода строки).
+    """
+    offsets = {}
+    chunks = []
+    pos = 0
+    for section in SECTION_FILES:
+        chunk = dumps_nodes(data.get(section, [])).encode("utf-8")
+        offsets[section] = [pos, len(chunk)]
+        chunks.append(chunk)
+        pos += len(chunk)
+    header = json.dumps({"version": BUNDLE_VERSION, "sections": offsets})
+    return header.encode("utf-8") + b"\n" + b"".join(chunks)
+
+
+def _decode_bundle(body: bytes) -> dict:
+    """
+    Разбираем снимок из _encode_bundle обратно в {раздел: список}.
+    """
+    header_raw, _, payload = body.partition(b"\n")
+    header = json.loads(header_raw)
+    if header.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"unsupported bundle version: {header.get('version')}")
+    result = {}
+    for section, (offset, length) in header["sections"].items():
+        result[section] = json.loads(payload[offset:offset + length])
     return result
 
 
+def _download_bundle(base="", revs=None):
+    """
+    Скачиваем снимок из Dropbox (base – папка пользователя, см. _user_base).
+    Если снимка нет – возвращаем None, прочие ошибки пробрасываем
+    (чтобы не перепутать "снимка нет" с "Dropbox не ответил").
+    revs – список файлов папки (_list_revs): снимка в нём нет – не спрашиваем.
+    """
+    if revs is not None and BUNDLE_FILE not in revs:
+        return None
+    try:
+        md, res = _dbx().files_download(_path(base + BUNDLE_FILE))
+    except ApiError as e:
+        if _is_not_found(e):
+            return None
+        raise
+    _remote_meta[_path(base + BUNDLE_FILE)] = (md.content_hash, md.rev)
+    return _decode_bundle(res.content)
+
+
+def _upload_bundle(data, base=""):
+    """
+    Загружаем снимок в Dropbox, перезаписывая файл.
+    True – случился конфликт (см. _upload_body).
+    """
+    return _upload_body(_path(base + BUNDLE_FILE), _encode_bundle(data))
+
+
+def _download_sections(base="", revs=None) -> dict:
+    """
+    Скачиваем разделы из отдельных файлов: {раздел: сырые данные}.
+    Раздел, который не скачался, – LOAD_FAILED (см. load_data).
+    """
+    raw = _download_many([base + filename for filename in SECTION_FILES.values()], default=[],
+                         item_hook=Node.from_json, revs=revs, on_error=LOAD_FAILED)
+    return {section: raw[base + filename] for section, filename in SECTION_FILES.items()}
+
+
+def _load_bundle_layout(base="") -> dict:
+    """
+    Раскладка "bundle": весь набор разделов одним запросом.
+    Если снимка ещё нет – один раз переносим в него данные из отдельных файлов.
+    """
+    try:
+        sections = _download_bundle(base)
+    except Exception as e:
+        # Снимок есть, но не скачался/не разобрался. Отдельные файлы
+        # старше снимка: прочитав их, следующее сохранение затёрло бы
+        # снимок старыми данными. Поэтому разделы не загружены (LOAD_FAILED).
+        print(f"[storage] Dropbox bundle error for {base}{BUNDLE_FILE}: {e}")
+        return {section: LOAD_FAILED for section in SECTION_FILES}
+
+    if sections is None:
+        sections = _download_sections(base)
+        if any(raw is LOAD_FAILED for raw in sections.values()):
+            return sections  # перенесём, когда скачаются все файлы
+        _upload_bundle(sections, base)
+        print(f"[storage] migrated {len(sections)} section files into {base}{BUNDLE_FILE}")
+    return sections
+
+
+def _load_files_layout(base="") -> dict:
+    """
+    Раскладка "files": каждый раздел в своём файле.
+    Если остался снимок от режима "bundle" – он свежее файлов (в режиме
+    "bundle" файлы не обновляются), поэтому раскладываем его обратно
+    по файлам и убираем в BUNDLE_FILE.bak. Это и есть откат с "bundle".
+    """
+    # С локальным кэшем сначала узнаём ревизии файлов: неизменившиеся
+    # разделы читаются с диска, а отсутствующие файлы не запрашиваются
+    revs = _list_revs(base) if disk_cache.ENABLED else None
+    bundle_future = _load_pool.submit(_download_bundle, base, revs)
+    sections = _download_sections(base, revs)
+    try:
+        bundle = bundle_future.result(timeout=LOAD_TIMEOUT)
+    except Exception as e:
+        # Не знаем, остался ли снимок: если остался, файлы старше его –
+        # не загружаем их, пока не выясним (см. _LazyFilesLoader)
+        print(f"[storage] Dropbox bundle error for {base}{BUNDLE_FILE}: {e}")
+        return {section: LOAD_FAILED for section in SECTION_FILES}
+
+    if bundle is None:
+        return sections
+    _restore_files_from_bundle(bundle, base)
+    return bundle
+
+
+def _restore_files_from_bundle(bundle, base=""):
+    """Разложить оставшийся снимок по файлам и убрать его в BUNDLE_FILE.bak."""
+    for section, filename in SECTION_FILES.items():
+        _upload_section(base + filename, bundle.get(section, []))
+    _dbx().files_move_v2(_path(base + BUNDLE_FILE), _path(base + BUNDLE_FILE + ".bak"), autorename=True)
+    _remote_meta.pop(_path(base + BUNDLE_FILE), None)
+    print(f"[storage] restored section files from {base}{BUNDLE_FILE}")
+
+
+class _LazyFilesLoader:
+    """
+    Загрузка по одному разделу для раскладки "files" (UserData.lazy).
+    Проверка на оставшийся снимок (откат с "bundle", см. _load_files_layout)
+    идёт параллельно с первым файлом; если снимок есть – разделы берём из него.
+    """
+
+    def __init__(self, base=""):
+        self._base = base
+        # Ревизии файлов (для локального кэша) и снимок ставим в пул раньше
+        # разделов: задачи разделов их ждут
+        self._revs_future = _load_pool.submit(_list_revs, base) if disk_cache.ENABLED else None
+        self._bundle_future = _load_pool.submit(lambda: _download_bundle(base, self._revs()))
+        self._lock = threading.Lock()
+        self._checked = False
+        self._bundle = None
+
+    def _leftover_bundle(self):
+        with self._lock:
+            if not self._checked:
+                future, self._bundle_future = self._bundle_future, None
+                if future is None:
+                    future = _load_pool.submit(_download_bundle, self._base)
+                try:
+                    self._bundle = future.result(timeout=LOAD_TIMEOUT)
+                except Exception as e:
+                    # Снимок мог остаться, а файлы старше его – раздел не
+                    # загружен; при следующем обращении проверим снова
+                    print(f"[storage] Dropbox bundle error for {self._base}{BUNDLE_FILE}: {e}")
+                    raise SectionLoadError(BUNDLE_FILE) from e
+                if self._bundle is not None:
+                    _restore_files_from_bundle(self._bundle, self._base)
+                self._checked = True
+            return self._bundle
+
+    def _revs(self):
+        if self._revs_future is None:
+            return None
+        try:
+            return self._revs_future.result(timeout=LOAD_TIMEOUT)
+        except Exception as e:
+            print(f"[storage] Dropbox list_folder error for {self._base or FOLDER}: {e}")
+            return None
+
+    def __call__(self, section):
+        raw = _download_json(self._base + SECTION_FILES[section], default=[], item_hook=Node.from_json,
+                             revs=self._revs(), on_error=LOAD_FAILED)
+        bundle = self._leftover_bundle()
+        if bundle is not None:
+            return bundle.get(section, [])
+        if raw is LOAD_FAILED:
+            raise SectionLoadError(section)
+        return raw
+
+
+def _reconcile(data, filename, fetched):
+    """
+    После конфликта (_upload_body вернул True) в памяти остаётся наша
+    версия, а в Dropbox – чужая, более новая. Берём чужую: подменяем
+    разделы версией, скачанной в очереди записи (fetched, см. save_data),
+    – наша лежит рядом копией. Если скачать не вышло или раздел уже снова
+    изменили, путь остаётся с прежней ревизией – следующая запись снова
+    уйдёт в копию, а не поверх чужой версии. Вызывается под user_lock.
+    """
+    sections = _apply_file(data, filename, *fetched)
+    if sections:
+        print(f"[storage] conflict on {filename}: took the newer remote version of {', '.join(sections)}")
+
+
+# ====== БЭКЕНДЫ ======
+#
+# Бэкенд – объект с методами:
+#   load(user_id) -> {раздел: список}        – прочитать все разделы;
+#   encode(user_id, data, sections) -> payload – снимок перечисленных разделов
+#                                              (под user_lock, см. save_data);
+#   write(user_id, payload) -> [файл]        – записать снимок (уже без замка),
+#                                              вернуть файлы с конфликтом;
+#   section_loader(user_id) -> load(section) или None – чтение по одному
+#                                              разделу (для ленивой загрузки).
+# Если у бэкенда item_writes = True, он ещё умеет писать один элемент
+# верхнего уровня, не переписывая раздел целиком:
+#   put_item(user_id, section, item)         – добавить/обновить элемент по item.id;   
+#   delete_item(user_id, section, item_id)   – удалить элемент (вместе с детьми).
+# Для режима журнала (STORAGE_JOURNAL=1):
+#   append_ops(user_id, ops)                 – дописать записи [(seq, json)];
+#   load_ops(user_id) -> (mark, [op])        – записи после последней свёртки;
+#   compact(user_id, payload, seq) -> [файл] – записать снимок из encode
+#                                              и отметить, что журнал до seq
+#                                              в нём учтён.
+# Контекст списков (UserData.contexts):
+#   load_contexts(user_id) -> {message_id: [section, parent, expires_at]};
+#   save_contexts(user_id, contexts).
+# Реестр пользователей (см. register_user):
+#   load_users() -> {user_id: запись} или None, если реестра ещё нет;
+#   save_users(users) -> записанный реестр (или None – записан как есть).
+
+class DropboxBackend:
+    """
+    Разделы в Dropbox: по файлу на раздел или один снимок (STORAGE_LAYOUT).
+    У каждого пользователя своя папка (см. _user_base).
+    """
+
+    name = "dropbox"
+    item_writes = False
+
+    def load(self, user_id):
+        base = _user_base(user_id)
+        if STORAGE_LAYOUT == "bundle":
+            return _load_bundle_layout(base)
+        return _load_files_layout(base)
+
+    def section_loader(self, user_id):
+        # Снимок и так приходит одним запросом – по разделам его не читаем
+        if STORAGE_LAYOUT == "bundle":
+            return None
+        return _LazyFilesLoader(_user_base(user_id))
+
+    def encode(self, user_id, data, sections):
+        """{файл: тело} – в раскладке "bundle" любое изменение – это весь снимок."""
+        base = _user_base(user_id)
+        if STORAGE_LAYOUT == "bundle":
+            return {base + BUNDLE_FILE: _encode_bundle(data)}
+        return {
+            base + SECTION_FILES[section]: section_format.encode(data.get(section, []), compact=JSON_COMPACT)
+            for section in sections
+        }
+
+    def write(self, user_id, payload):
+        return [filename for filename, body in payload.items() if _upload_encoded(_path(filename), body)]
+
+    def load_contexts(self, user_id):
+        return _download_json(_user_base(user_id) + CONTEXTS_FILE, default={})
+
+    def save_contexts(self, user_id, contexts):
+        filename = _user_base(user_id) + CONTEXTS_FILE
+        encode = lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        # В JSON ключи – строки
+        contexts = {str(mid): entry for mid, entry in contexts.items()}
+        if _upload_body(_path(filename), encode(contexts)):
+            # Контекст дописал другой воркер – сливаем (свои записи важнее)
+            remote = _download_json(filename, default={})
+            _upload_body(_path(filename), encode(dict(remote, **contexts)))
+
+    # --- реестр пользователей: один файл USERS_FILE в корне FOLDER ---
+
+    def load_users(self):
+        try:
+            md, res = _dbx().files_download(_path(USERS_FILE))
+        except ApiError as e:
+            if _is_not_found(e):
+                return None
+            raise
+        _remote_meta[_path(USERS_FILE)] = (md.content_hash, md.rev)
+        return json.loads(res.content)
+
+    def save_users(self, users):
+        encode = lambda obj: json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+        if not _upload_body(_path(USERS_FILE), encode(users)):
+            return users
+        # Реестр дописал другой воркер – сливаем и возвращаем итог
+        merged = dict(self.load_users() or {}, **users)
+        _upload_body(_path(USERS_FILE), encode(merged))
+        return merged
+
+    # --- журнал: файлы journal/<seq>.json со списками записей ---
+    # В Dropbox нельзя дописать в конец файла, поэтому каждая пачка записей –
+    # отдельный маленький файл, а номер последней свёрнутой записи – в mark.json.
+
+    def append_ops(self, user_id, ops):
+        base = _user_base(user_id)
+        body = "[" + ",".join(op for _, op in ops) + "]"
+        _upload_body(_path(f"{base}{JOURNAL_FOLDER}/{ops[-1][0]:010d}.json"), body.encode("utf-8"))
+
+    def load_ops(self, user_id):
+        base = _user_base(user_id)
+        mark = _download_json(base + JOURNAL_MARK, default={}).get("seq", 0)
+        names = [name for name in self._journal_files(base) if int(name[:-5]) > mark]
+        batches = _download_many([f"{base}{JOURNAL_FOLDER}/{name}" for name in names], default=[])
+        ops = [op for batch in batches.values() for op in batch if op["seq"] > mark]
+        ops.sort(key=lambda op: op["seq"])
+        return mark, ops
+
+    def compact(self, user_id, payload, seq):
+        base = _user_base(user_id)
+        conflicts = self.write(user_id, payload)
+        # Порядок важен: сначала разделы, потом отметка, потом чистка журнала
+        _upload_body(_path(base + JOURNAL_MARK), json.dumps({"seq": seq}).encode("utf-8"))
+        for name in self._journal_files(base):
+            if int(name[:-5]) <= seq:
+                _dbx().files_delete_v2(_path(f"{base}{JOURNAL_FOLDER}/{name}"))
+        return conflicts
+
+    def _journal_files(self, base):
+        """Имена файлов журнала (без mark.json)."""
+        try:
+            res = _dbx().files_list_folder(_path(base + JOURNAL_FOLDER))
+        except ApiError as e:
+            if _is_not_found(e):
+                return []
+            raise
+        entries = list(res.entries)
+        while res.has_more:
+            res = _dbx().files_list_folder_continue(res.cursor)
+            entries.extend(res.entries)
+        return sorted(e.name for e in entries if e.name[:-5].isdigit())
+
+
+_backend = None
+
+
+def get_backend():
+    """Текущий бэкенд хранения (выбирается переменной STORAGE_BACKEND)."""
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND == "sqlite":
+            from storage_sqlite import SQLiteBackend
+            _backend = SQLiteBackend()
+        elif STORAGE_BACKEND == "dropbox":
+            _backend = DropboxBackend()
+        else:
+            raise RuntimeError(f"Неизвестный STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return _backend
+
+
+# ====== ПОЛЬЗОВАТЕЛИ ======
+#
+# Загрузка одного пользователя и снимок для сохранения идут под его замком
+# (user_lock), сама запись – уже без замка, но по очереди (_SaveOrder).
+# Разные пользователи – параллельно, общего замка на запись нет.
+
+_user_locks = {}
+_user_locks_guard = threading.Lock()
+
+# Реестр читается без замка: словарь не правится на месте, а заменяется
+# целиком. _users_lock – только первая загрузка, _users_write_lock –
+# запись новых пользователей (по очереди, но известных пользователей
+# этот замок не задерживает).
+_users = None  # реестр: {str(user_id): {"folder": ..., "created_at": ...}}
+_users_missing = False  # реестра не было (первый запуск после разделения)
+_users_lock = threading.Lock()
+_users_write_lock = threading.Lock()
+
+
+def user_lock(user_id):
+    """Замок пользователя (RLock): один на user_id на весь процесс."""
+    with _user_locks_guard:
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = _user_locks[user_id] = threading.RLock()
+        return lock
+
+
+def _load_users():
+    global _users, _users_missing
+    users = _users
+    if users is None:
+        with _users_lock:
+            if _users is None:
+                loaded = get_backend().load_users()
+                _users_missing = loaded is None
+                _users = loaded or {}
+            users = _users
+    return users
+
+
+def _refresh_users():
+    """Перечитать реестр – его дописал другой воркер (см. apply_remote_changes)."""
+    global _users
+    with _users_write_lock:
+        remote = get_backend().load_users()
+        if remote is not None:
+            _users = dict(_load_users(), **remote)
+
+
+def register_user(user_id):
+    """
+    Запись пользователя в реестре; при первом обращении – создаём её
+    и выдаём папку. user_id=None (старые вызовы без пользователя) – корень.
+    """
+    if user_id is None:
+        return {"folder": ""}
+    global _users
+    key = str(user_id)
+    entry = _load_users().get(key)
+    if entry is not None:
+        return entry
+    with _users_write_lock:
+        users = _load_users()
+        entry = users.get(key)
+        if entry is None:
+            entry = {
+                "folder": _new_user_folder(key, users),
+                "created_at": datetime.datetime.utcnow().isoformat(),
+            }
+            # Бэкенд может вернуть реестр, слитый с чужими записями
+            saved = get_backend().save_users(dict(users, **{key: entry}))
+            _users = dict(users, **(saved or {key: entry}))
+            print(f"[storage] registered user {key} (folder: {entry['folder'] or '/'})")
+        return entry
+
+
+def _new_user_folder(key, users):
+    """Папка нового пользователя: корень – владельцу старых файлов, иначе своя."""
+    root_taken = any(entry["folder"] == "" for entry in users.values())
+    if not root_taken and (key == LEGACY_USER or (not LEGACY_USER and _users_missing)):
+        return ""
+    return f"{USERS_FOLDER}/{key}"
+
+
+def registered_users():
+    """id всех известных пользователей (строки, как в реестре)."""
+    return list(_load_users())
+
+
+def _user_base(user_id) -> str:
+    """Префикс путей пользователя в FOLDER: "" или "users/<id>/"."""
+    folder = register_user(user_id)["folder"]
+    return f"{folder}/" if folder else ""
+
+
 def load_data(user_id):
     """
-    Загружаем ВСЕ разделы из Dropbox и возвращаем единый dict.
-    user_id по сути не используется – у нас один набор файлов.
-    """
-    inbox = _download_json("tasks.json", default=[])
-    today = _download_json("today.json", default=[])
-    routines = _download_json("routines.json", default=[])
-    templates = _download_json("templates.json", default=[])
-    projects = _download_json("projects.json", default=[])
-    habits = _download_json("habits.json", default=[])
-    sos = _download_json("sos.json", default=[])
-
-    data = {
-        "inbox": _normalize_list(inbox),
-        "today": _normalize_list(today),
-        "routines": _normalize_list(routines),
-        "templates": _normalize_list(templates),
-        "projects": _normalize_list(projects),
-        "habits": _normalize_list(habits),
-        "sos": _normalize_list(sos),
-    }
+    Загружаем разделы из бэкенда и возвращаем единый dict (UserData).
+    У каждого пользователя свои файлы (см. register_user).
+    С LAZY_LOAD разделы читаются при первом обращении (см. UserData.lazy),
+    иначе – все сразу: файлы параллельно (см. _download_many), в раскладке
+    "bundle" – одним снимком.
+    """
+    started = time.monotonic()
+    backend = get_backend()
+    register_user(user_id)
+    contexts_future = _load_pool.submit(backend.load_contexts, user_id)
+    load_section = backend.section_loader(user_id) if LAZY_LOAD else None
+    if load_section is not None:
+        # Разделы подгрузятся при первом обращении (или в фоне, STORAGE_PREFETCH)
+        data = UserData.lazy(load_section, SECTION_FILES)
+    else:
+        raw = backend.load(user_id)
+        failed = [section for section in SECTION_FILES if raw.get(section) is LOAD_FAILED]
+        # Старые форматы (строки, "text" вместо "title") разбирает Node.from_json
+        data = UserData((section, raw.get(section)) for section in SECTION_FILES if section not in failed)
+        if failed:
+            # Не скачавшиеся разделы остаются незагруженными: их дочитает
+            # первое обращение, а до тех пор они не сохраняются
+            data._loader = backend.section_loader(user_id)
+            if data._loader is None:
+                raise SectionLoadError(", ".join(failed))
+            for section in failed:
+                data._pending[section] = None
+    # Контекст нужен только для ответов на списки – не ждём его здесь
+    data._contexts_future = contexts_future
+    if JOURNAL:
+        _replay_journal(backend, user_id, data)
+    print(f"[storage] load_data ({backend.name}): {time.monotonic() - started:.2f} s")
     return data
 
 
+async def load_data_async(user_id):
+    """
+    load_data для asyncio-кода (asgi.py): загрузка идёт в пуле потоков
+    и не держит цикл событий.
+    """
+    return await asyncio.to_thread(load_data, user_id)
+
+
+def _replay_journal(backend, user_id, data):
+    """Применить к снимку хвост журнала (он же восстанавливает data.undo)."""
+    mark, ops = backend.load_ops(user_id)
+    data.journal_seq = mark
+    for op in ops:
+        try:
+            action = mutations.apply(data, op)
+        except (IndexError, KeyError, TypeError) as e:
+            print(f"[storage] journal replay error at op {op.get('seq')}: {e}")
+            continue
+        data.journal_seq = op["seq"]
+        data.journal_sections.update(mutations.touched_sections(action))
+    data.ops_since_compaction = len(ops)
+    if ops:
+        print(f"[storage] replayed {len(ops)} journal ops after op {mark}")
+
+
+def record_op(user_id, data, op, action):
+    """
+    Зафиксировать изменение op, уже применённое к data (mutations.apply).
+    Изменение и запись должны идти под одним user_lock – иначе свёртка
+    журнала между ними учтёт op в снимке, но не в отметке.
+    В режиме журнала запись ставится в очередь журнала, иначе
+    затронутые разделы помечаются dirty.
+    """
+    sections = mutations.touched_sections(action)
+    if not JOURNAL:
+        data.mark_dirty(*sections)
+        return
+    data.journal_seq += 1
+    record = dict(op, seq=data.journal_seq)
+    # Сериализуем сразу: элемент из "add" дальше может меняться в памяти
+    data.pending_ops.append((data.journal_seq, dumps_nodes(record)))
+    data.journal_sections.update(sections)
+
+
 def save_data(user_id, data):
     """
-    Сохраняем разделы обратно в отдельные файлы Dropbox.
+    Сохраняем разделы обратно в бэкенд.
+    Для UserData сохраняем только изменённые разделы (dirty),
+    для обычного dict – все разделы, как раньше.
+    Под user_lock разделы только снимаются и кодируются в байты
+    (_prepare_save), а заливка и разбор конфликтов идут уже без замка:
+    хендлеры этого пользователя не ждут Dropbox. Записи одного
+    пользователя уходят в том порядке, в каком сняты (_SaveOrder),
+    разных – параллельно.
+    """
+    order = _save_order(user_id)
+    with user_lock(user_id):
+        job = _prepare_save(user_id, data)
+        if job.empty():
+            return
+        ticket = order.take()
+    try:
+        with order.turn(ticket):
+            conflicts = job.write(user_id)
+            # Чужую версию качаем, пока очередь наша: следующая запись
+            # этого пользователя не проскочит между скачиванием и подменой
+            fetched = {filename: _fetch_file(filename)
+                       for filename in conflicts if isinstance(data, UserData)}
+    except Exception:
+        with user_lock(user_id):
+            job.done(ok=False)
+        raise
+    with user_lock(user_id):
+        job.done(ok=True)
+        for filename, result in fetched.items():
+            _reconcile(data, filename, result)
+
+
+class _SaveOrder:
+    """
+    Очередь записей одного пользователя: номер берётся вместе со снимком
+    под user_lock (take), а запись ждёт своего номера уже без замка (turn).
+    Так более старый снимок не ляжет поверх более нового.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._next = 0
+        self._serving = 0
+
+    def take(self) -> int:
+        with self._cond:
+            ticket = self._next
+            self._next += 1
+            return ticket
+
+    @contextlib.contextmanager
+    def turn(self, ticket):
+        with self._cond:
+            self._cond.wait_for(lambda: self._serving == ticket)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._serving += 1
+                self._cond.notify_all()
+
+
+_save_orders = {}
+
+
+def _save_order(user_id):
+    with _user_locks_guard:
+        order = _save_orders.get(user_id)
+        if order is None:
+            order = _save_orders[user_id] = _SaveOrder()
+        return order
+
+
+class _SaveJob:
+    """
+    Снимок для записи (_prepare_save): закодированные разделы, контекст
+    списков и записи журнала, а ещё – какие флаги с data сняты, чтобы
+    вернуть их, если запись не удалась.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.contexts = None    # контекст списков для save_contexts
+        self.payload = {}       # backend.encode: {файл или раздел: данные}
+        self.dirty = set()      # снятые флаги dirty
+        self.journaled = set()  # снятые journal_sections (свёртка)
+        self.ops = []           # записи журнала [(seq, json)]
+        self.seq = None         # свёртка журнала до этой записи
+
+    def empty(self) -> bool:
+        return self.contexts is None and not self.payload and not self.ops and self.seq is None
+
+    def write(self, user_id):
+        """Записать в бэкенд (без user_lock). Возвращает файлы с конфликтом."""
+        backend = get_backend()
+        if self.contexts is not None:
+            backend.save_contexts(user_id, self.contexts)
+            self.contexts = None
+        if self.seq is not None:
+            return backend.compact(user_id, self.payload, self.seq)
+        if self.ops:
+            backend.append_ops(user_id, self.ops)
+        if self.payload:
+            return backend.write(user_id, self.payload)
+        return []
+
+    def done(self, ok):
+        """После записи (под user_lock): обновить счётчики или вернуть флаги."""
+        data = self.data
+        if not isinstance(data, UserData):
+            return
+        for key in self.payload:
+            data.saving[key] -= 1
+            if data.saving[key] <= 0:
+                del data.saving[key]
+        if ok:
+            if self.seq is not None:
+                data.ops_since_compaction = 0
+                print(f"[storage] journal compacted at op {self.seq}")
+            else:
+                data.ops_since_compaction += len(self.ops)
+            return
+        # Если раздел поменяли, пока мы писали, он и так dirty
+        if self.contexts is not None:
+            data.contexts_dirty = True
+        data.dirty.update(self.dirty)
+        data.journal_sections.update(self.journaled)
+        data.pending_ops[:0] = self.ops
+
+
+def _prepare_save(user_id, data):
+    """
+    Под user_lock: снять флаги и закодировать то, что нужно записать
+    (см. _SaveJob). Флаги снимаем до записи: если раздел поменяют, пока
+    мы пишем, он снова станет dirty и сохранится в следующий раз.
+    """
+    job = _SaveJob(data)
+    backend = get_backend()
+    if not isinstance(data, UserData):
+        job.payload = backend.encode(user_id, data, list(SECTION_FILES))
+        return job
+
+    if data.contexts_dirty:
+        # Истёкшие записи контекста при этом выбрасываем
+        data.contexts_dirty = False
+        data.contexts = job.contexts = data.live_contexts()
+
+    if JOURNAL:
+        # Режим журнала: дописываем накопленные записи. Если записей после
+        # свёртки набралось JOURNAL_COMPACT_EVERY или есть изменения мимо
+        # журнала (dirty), сворачиваем: пишем разделы снимком и отмечаем,
+        # что журнал до текущей записи в нём уже учтён.
+        job.ops, data.pending_ops = data.pending_ops, []
+        if not data.dirty and data.ops_since_compaction + len(job.ops) < JOURNAL_COMPACT_EVERY:
+            return job
+        job.seq = data.journal_seq
+        job.dirty, job.journaled = set(data.dirty), set(data.journal_sections)
+        data.dirty.clear()
+        data.journal_sections.clear()
+        sections = [s for s in SECTION_FILES if s in job.dirty or s in job.journaled]
+    else:
+        sections = [s for s in SECTION_FILES if s in data.dirty]
+        job.dirty = set(sections)
+        data.dirty.difference_update(sections)
+
+    if sections:
+        try:
+            job.payload = backend.encode(user_id, data, sections)
+        except Exception:
+            job.done(ok=False)
+            raise
+        # Пока файл заливается, его изменение в Dropbox – скорее всего
+        # наша же заливка (см. _reload_remote_files)
+        data.saving.update(list(job.payload))
+    return job
+
+
+# ====== ИЗМЕНЕНИЯ ИЗВНЕ ======
+#
+# Файлы в Dropbox меняет не только этот процесс (приложение Dropbox, другой
+# воркер). change_feed.py следит за папкой и передаёт сюда изменившиеся
+# файлы: разделы пользователей, уже загруженных в tasks_by_user,
+# перечитываются и подменяются в памяти (UserData.replace_section).
+
+def _watched_names():
+    """Файлы пользователя, за которыми следим: снимок или файлы разделов."""
+    return [BUNDLE_FILE] if STORAGE_LAYOUT == "bundle" else list(SECTION_FILES.values())
+
+
+def _watched_files():
+    """{путь в Dropbox в нижнем регистре: (user_id, файл)} загруженных пользователей."""
+    watched = {}
+    for user_id in list(tasks_by_user):
+        base = _user_base(user_id)
+        for name in _watched_names():
+            watched[_path(base + name).lower()] = (user_id, base + name)
+    return watched
+
+
+def apply_remote_changes(changes) -> int:
+    """
+    Применить изменения файлов [(путь, rev или None – файл удалён)].
+    Свои заливки (rev уже в _remote_meta) пропускаются. Возвращает число
+    подменённых разделов.
+    """
+    watched = _watched_files()
+    by_user = {}
+    for path, rev in changes:
+        path = path.lower()
+        if path == _path(USERS_FILE).lower():
+            known = _remote_meta.get(_path(USERS_FILE))
+            if not known or known[1] != rev:
+                # Реестр дописал другой воркер
+                _refresh_users()
+            continue
+        if path in watched:
+            user_id, filename = watched[path]
+            by_user.setdefault(user_id, {})[filename] = rev
+    replaced = 0
+    for user_id, files in by_user.items():
+        data = tasks_by_user.get(user_id)
+        if isinstance(data, UserData):
+            replaced += _reload_remote_files(user_id, data, files)
+    return replaced
+
+
+def _reload_remote_files(user_id, data, files) -> int:
+    """
+    Подменить разделы из изменившихся файлов пользователя {файл: rev}.
+    Проверки и подмена – под user_lock, скачивание – без него, но в
+    очереди записей пользователя (_SaveOrder): его заливка не пройдёт
+    между скачиванием и подменой.
+    """
+    order = _save_order(user_id)
+    replaced = []
+    with user_lock(user_id):
+        todo = []
+        for filename, rev in files.items():
+            path = _path(filename)
+            known = _remote_meta.get(path)
+            if (known[1] if known else None) == rev or data.saving.get(filename):
+                # Своя заливка: rev уже известен или файл ещё заливается
+                continue
+            busy = _busy_sections(data, filename)
+            if busy:
+                # Несохранённые правки важнее: сохранение перепишет файл (с
+                # STORAGE_CONDITIONAL_WRITES – уйдёт в копию, а в памяти окажется
+                # версия из Dropbox, см. _reconcile)
+                print(f"[storage] {filename} changed remotely, keeping unsaved local changes in {', '.join(busy)}")
+            elif rev is None:
+                _remote_meta.pop(path, None)
+                if not filename.endswith(BUNDLE_FILE):
+                    # без снимка следующая загрузка и так возьмёт файлы разделов
+                    section = _file_sections(filename)[0]
+                    data.replace_section(section, [])
+                    replaced.append((filename, [section]))
+            else:
+                todo.append(filename)
+        if not todo and not replaced:
+            return 0
+        ticket = order.take()
+    with order.turn(ticket):
+        fetched = {filename: _fetch_file(filename) for filename in todo}
+    with user_lock(user_id):
+        for filename, result in fetched.items():
+            sections = _apply_file(data, filename, *result)
+            if sections:
+                replaced.append((filename, sections))
+    for filename, sections in replaced:
+        print(f"[storage] reloaded {', '.join(sections)} from {filename} (changed remotely)")
+    return sum(len(sections) for _, sections in replaced)
+
+
+def _file_sections(filename) -> list:
+    """Разделы, которые лежат в файле: снимок – все, файл раздела – один."""
+    if filename.endswith(BUNDLE_FILE):
+        return list(SECTION_FILES)
+    name = filename.rsplit("/", 1)[-1]
+    return [section for section, section_file in SECTION_FILES.items() if section_file == name]
+
+
+def _busy_sections(data, filename) -> list:
+    """Разделы файла с несохранёнными правками (или файл сейчас заливается)."""
+    sections = _file_sections(filename)
+    if data.saving.get(filename):
+        return sections
+    return [section for section in sections if section in data.dirty or section in data.journal_sections]
+
+
+def _fetch_file(filename):
+    """
+    Скачать файл раздела (или снимок) без user_lock: ({раздел: сырые
+    данные}, (content_hash, rev)) или (None, None) – скачать не вышло.
+    _remote_meta при этом не меняется: новая ревизия запоминается только
+    вместе с подменой разделов (_apply_file).
+    """
+    path = _path(filename)
+    known = _remote_meta.get(path)
+    try:
+        if filename.endswith(BUNDLE_FILE):
+            try:
+                raw = _download_bundle(filename[:-len(BUNDLE_FILE)])
+            except Exception as e:
+                print(f"[storage] Dropbox bundle error for {filename}: {e}")
+                raw = None
+        else:
+            items = _download_json(filename, default=None, item_hook=Node.from_json)
+            raw = None if items is None else {_file_sections(filename)[0]: items}
+        return raw, (_remote_meta.get(path) if raw is not None else None)
+    finally:
+        if known is None:
+            _remote_meta.pop(path, None)
+        else:
+            _remote_meta[path] = known
+
+
+def _apply_file(data, filename, raw, meta) -> list:
+    """
+    Подменить разделы в data скачанной версией файла (под user_lock).
+    Если их успели изменить в памяти, пока качали, – не трогаем.
+    Возвращает подменённые разделы.
+    """
+    if raw is None:
+        return []
+    busy = _busy_sections(data, filename)
+    if busy:
+        print(f"[storage] {filename} changed remotely, keeping unsaved local changes in {', '.join(busy)}")
+        return []
+    sections = _file_sections(filename)
+    for section in sections:
+        data.replace_section(section, raw.get(section) or [])
+    _remote_meta[_path(filename)] = meta
+    return sections
+
+
+def resync_remote() -> int:
+    """
+    Сверить ревизии файлов всех загруженных пользователей с Dropbox
+    (list_folder по папке) – после сброса курсора change_feed.
     """
-    _upload_json("tasks.json", data.get("inbox", []))
-    _upload_json("today.json", data.get("today", []))
-    _upload_json("routines.json", data.get("routines", []))
-    _upload_json("templates.json", data.get("templates", []))
-    _upload_json("projects.json", data.get("projects", []))
-    _upload_json("habits.json", data.get("habits", []))
-    _upload_json("sos.json", data.get("sos", []))
\ No newline at end of file
+    changes = []
+    for user_id in list(tasks_by_user):
+        base = _user_base(user_id)
+        revs = _list_revs(base)
+        if revs is None:
+            continue
+        for name in _watched_names():
+            remote = revs.get(name)
+            changes.append((_path(base + name), remote[1] if remote else None))
+    return apply_remote_changes(changes)
+
+
+# ====== ЗАДАЧИ ======
+#
+# Функции для bot/inbox.py, bot/today.py и logic_tasks.py. Работают с тем же
+# кэшем tasks_by_user, что и main.py, а изменение одного элемента сохраняют
+# точечно: бэкенд с item_writes пишет одну строку, Dropbox – раздел целиком
+# (через очередь write_behind). Изменение и _commit_item идут под
+# user_lock, как хендлеры main.py.
+
+def _user_data(user_id):
+    """Данные пользователя из кэша (при первом обращении – из бэкенда)."""
+    if user_id not in tasks_by_user:
+        with user_lock(user_id):
+            if user_id not in tasks_by_user:
+                tasks_by_user[user_id] = load_data(user_id)
+    return tasks_by_user[user_id]
+
+
+def _find(data, section, item_id):
+    """Элемент верхнего уровня раздела по id (через индекс) или None."""
+    entry = data.find(item_id)
+    if entry is None or entry[0] != section or entry[1] is not None:
+        return None
+    return entry[2]
+
+
+def _schedule_save(user_id, data):
+    # write_behind сам импортирует storage, поэтому импортируем здесь
+    from write_behind import schedule_save
+    schedule_save(user_id, data)
+
+
+def _commit_item(user_id, data, section, item=None, deleted_id=None):
+    """
+    Сохранить изменение одного элемента верхнего уровня раздела:
+    item – добавленный/изменённый элемент, deleted_id – id удалённого.
+    """
+    data.touch(section)
+    backend = get_backend()
+    # В режиме журнала снимок нельзя править мимо журнала – иначе
+    # позиции в записях журнала разойдутся с разделами при воспроизведении.
+    if backend.item_writes and not JOURNAL:
+        if item is not None:
+            backend.put_item(user_id, section, item)
+        else:
+            backend.delete_item(user_id, section, deleted_id)
+        return
+    data.mark_dirty(section)
+    _schedule_save(user_id, data)
+
+
+def _task_view(item) -> dict:
+    """Задача в том виде, в каком её ждут bot/inbox.py и logic_tasks.py."""
+    return {
+        "id": item.id,
+        "text": item.title,
+        "done": item.done,
+        "comment": item.comment,
+        "created_at": item.created_at,
+    }
+
+
+def add_task(text, user_id=None):
+    """Добавить задачу в инбокс."""
+    with user_lock(user_id):
+        data = _user_data(user_id)
+        item = Node(text, id=data.new_id(), created_at=datetime.datetime.utcnow().isoformat())
+        data["inbox"].append(item)
+        data.index_node("inbox", None, item)
+        _commit_item(user_id, data, "inbox", item=item)
+        return _task_view(item)
+
+
+def list_active_tasks(user_id=None):
+    """Невыполненные задачи инбокса."""
+    data = _user_data(user_id)
+    return [_task_view(item) for item in data["inbox"] if not item.done]
+
+
+def active_tasks_page(start, end, user_id=None):
+    """
+    Срез [start:end] невыполненных задач инбокса и их общее число:
+    представления задач строятся только для среза.
+    """
+    data = _user_data(user_id)
+    active = [item for item in data["inbox"] if not item.done]
+    return [_task_view(item) for item in active[start:end]], len(active)
+
+
+def get_task_by_id(task_id, user_id=None):
+    """Задача инбокса по id или None."""
+    item = _find(_user_data(user_id), "inbox", task_id)
+    return _task_view(item) if item else None
+
+
+def update_task_text(task_id, text, user_id=None):
+    """Изменить текст задачи. Возвращает (успех, задача)."""
+    with user_lock(user_id):
+        data = _user_data(user_id)
+        item = _find(data, "inbox", task_id)
+        if not item:
+            return False, None
+        item.title = text
+        _commit_item(user_id, data, "inbox", item=item)
+        return True, _task_view(item)
+
+
+def complete_task_by_id(task_id, user_id=None):
+    """Отметить задачу выполненной. Возвращает (успех, задача)."""
+    with user_lock(user_id):
+        data = _user_data(user_id)
+        item = _find(data, "inbox", task_id)
+        if not item:
+            return False, None
+        item.done = True
+        _commit_item(user_id, data, "inbox", item=item)
+        return True, _task_view(item)
+
+
+def delete_task_by_id(task_id, user_id=None):
+    """Удалить задачу из инбокса. True, если она была."""
+    with user_lock(user_id):
+        data = _user_data(user_id)
+        item = _find(data, "inbox", task_id)
+        if not item:
+            return False
+        items = data["inbox"]
+        del items[next(i for i, x in enumerate(items) if x is item)]
+        data.unindex_node(item)
+        _commit_item(user_id, data, "inbox", deleted_id=task_id)
+        return True
+
+
+def add_today_from_task(task_id, user_id=None):
+    """
+    Добавить задачу в "Сегодня" (в инбоксе она остаётся).
+    Возвращает запись "Сегодня" или None, если задачи нет.
+    """
+    with user_lock(user_id):
+        data = _user_data(user_id)
+        task = _find(data, "inbox", task_id)
+        if not task:
+            return None
+        item = Node(task.title, id=data.new_id(), extra={"task_id": task_id})
+        data["today"].append(item)
+        data.index_node("today", None, item)
+        _commit_item(user_id, data, "today", item=item)
+        return {"id": item.id, "task_id": task_id, "text": item.title}
+
+
+def section_version(user_id, section):
+    """Версия раздела пользователя (для кэша отрисовки, см. render_cache.py)."""
+    return _user_data(user_id).version(section)
+
+
+def list_today(user_id=None):
+    """Записи списка "Сегодня"."""
+    data = _user_data(user_id)
+    return [
+        {"id": item.id, "task_id": item.task_id, "text": item.title}
+        for item in data["today"]
+    ]
@@ -0,0 +1,236 @@
+"""
+Локальное хранилище на SQLite (STORAGE_BACKEND=sqlite).
+
+Одна строка – один элемент любого раздела, вложенные элементы ссылаются
+на родителя. Поиск по id и по разделу идёт по индексам, поэтому правка
+одной задачи – это запись одной строки, а не перезапись всего раздела.
+База в режиме WAL: чтения не блокируют запись. Сеть не нужна – удобно
+для локального запуска и бенчмарков.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+from nodes import Node, dumps
+
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "planner.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    pk       INTEGER PRIMARY KEY,
+    user_id  TEXT    NOT NULL,
+    section  TEXT    NOT NULL,
+    parent   INTEGER REFERENCES items(pk) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    item_id  INTEGER,
+    data     TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_by_section ON items (user_id, section, parent, position);
+CREATE INDEX IF NOT EXISTS items_by_id ON items (user_id, item_id);
+CREATE INDEX IF NOT EXISTS items_by_parent ON items (parent);
+
+CREATE TABLE IF NOT EXISTS ops (
+    user_id TEXT    NOT NULL,
+    seq     INTEGER NOT NULL,
+    op      TEXT    NOT NULL,
+    PRIMARY KEY (user_id, seq)
+);
+CREATE TABLE IF NOT EXISTS journal_marks (
+    user_id TEXT    PRIMARY KEY,
+    seq     INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS contexts (
+    user_id TEXT PRIMARY KEY,
+    data    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    data    TEXT NOT NULL
+);
+"""
+
+
+class SQLiteBackend:
+    """
+    Бэкенд для storage.get_backend(): load/encode/write разделов целиком,
+    put_item/delete_item для правки одного элемента и таблица ops
+    для режима журнала (свёртка – одной транзакцией).
+    """
+
+    name = "sqlite"
+    item_writes = True
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        # По соединению на поток: sqlite3 не любит делить одно между потоками
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def load(self, user_id):
+        rows = self._conn().execute(
+            "SELECT pk, section, parent, data FROM items WHERE user_id = ? ORDER BY position",
+            (str(user_id),),
+        ).fetchall()
+        return _build_tree(rows)
+
+    def section_loader(self, user_id):
+        return lambda section: self.load_section(user_id, section)
+
+    def load_section(self, user_id, section):
+        rows = self._conn().execute(
+            "SELECT pk, section, parent, data FROM items WHERE user_id = ? AND section = ? ORDER BY position",
+            (str(user_id), section),
+        ).fetchall()
+        return _build_tree(rows).get(section, [])
+
+    def encode(self, user_id, data, sections):
+        """Копия разделов {раздел: список} – запись идёт уже без user_lock."""
+        return {section: json.loads(dumps(data.get(section, []))) for section in sections}
+
+    def write(self, user_id, payload):
+        conn = self._conn()
+        with conn:
+            self._save_sections(conn, user_id, payload)
+        return []
+
+    def append_ops(self, user_id, ops):
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO ops (user_id, seq, op) VALUES (?, ?, ?)",
+                [(str(user_id), seq, op) for seq, op in ops],
+            )
+
+    def load_ops(self, user_id):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT seq FROM journal_marks WHERE user_id = ?", (str(user_id),)
+        ).fetchone()
+        mark = row[0] if row else 0
+        rows = conn.execute(
+            "SELECT op FROM ops WHERE user_id = ? AND seq > ? ORDER BY seq",
+            (str(user_id), mark),
+        ).fetchall()
+        return mark, [json.loads(op) for (op,) in rows]
+
+    def compact(self, user_id, payload, seq):
+        """Разделы, отметка и чистка журнала – одной транзакцией."""
+        conn = self._conn()
+        with conn:
+            self._save_sections(conn, user_id, payload)
+            conn.execute(
+                "INSERT OR REPLACE INTO journal_marks (user_id, seq) VALUES (?, ?)",
+                (str(user_id), seq),
+            )
+            conn.execute(
+                "DELETE FROM ops WHERE user_id = ? AND seq <= ?", (str(user_id), seq)
+            )
+        return []
+
+    def load_contexts(self, user_id):
+        row = self._conn().execute(
+            "SELECT data FROM contexts WHERE user_id = ?", (str(user_id),)
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def save_contexts(self, user_id, contexts):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO contexts (user_id, data) VALUES (?, ?)",
+                (str(user_id), json.dumps(contexts, separators=(",", ":"))),
+            )
+
+    def load_users(self):
+        rows = self._conn().execute("SELECT user_id, data FROM users").fetchall()
+        if not rows:
+            return None
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    def save_users(self, users):
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)",
+                [(user_id, json.dumps(entry)) for user_id, entry in users.items()],
+            )
+
+    def put_item(self, user_id, section, item):
+        """Обновить элемент верхнего уровня по item["id"] или добавить его в конец раздела."""
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "UPDATE items SET data = ? WHERE user_id = ? AND item_id = ? AND section = ? AND parent IS NULL",
+                (_dump(item), str(user_id), item.id, section),
+            )
+            if cur.rowcount:
+                return
+            (last,) = conn.execute(
+                "SELECT MAX(position) FROM items WHERE user_id = ? AND section = ? AND parent IS NULL",
+                (str(user_id), section),
+            ).fetchone()
+            position = 0 if last is None else last + 1
+            self._insert(conn, user_id, section, None, position, item)
+
+    def delete_item(self, user_id, section, item_id):
+        """Удалить элемент верхнего уровня (дети удаляются каскадом)."""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "DELETE FROM items WHERE user_id = ? AND item_id = ? AND section = ? AND parent IS NULL",
+                (str(user_id), item_id, section),
+            )
+
+    def _save_sections(self, conn, user_id, payload):
+        for section, items in payload.items():
+            conn.execute(
+                "DELETE FROM items WHERE user_id = ? AND section = ?",
+                (str(user_id), section),
+            )
+            for position, item in enumerate(items):
+                self._insert(conn, user_id, section, None, position, item)
+
+    def _insert(self, conn, user_id, section, parent, position, item):
+        item = Node.from_json(item)
+        cur = conn.execute(
+            "INSERT INTO items (user_id, section, parent, position, item_id, data) VALUES (?, ?, ?, ?, ?, ?)",
+            (str(user_id), section, parent, position, item.id, _dump(item)),
+        )
+        for child_position, child in enumerate(item.children):
+            self._insert(conn, user_id, section, cur.lastrowid, child_position, child)
+
+
+def _build_tree(rows):
+    """{раздел: список} из строк (pk, section, parent, data), упорядоченных по position."""
+    nodes = {}
+    for pk, _, _, data in rows:
+        node = json.loads(data)
+        node["children"] = []
+        nodes[pk] = node
+
+    result = {}
+    for pk, section, parent, _ in rows:
+        if parent is None:
+            result.setdefault(section, []).append(nodes[pk])
+        elif parent in nodes:
+            nodes[parent]["children"].append(nodes[pk])
+    return result
+
+
+def _dump(item) -> str:
+    """Поля элемента без детей – дети лежат отдельными строками."""
+    fields = item.to_json()
+    del fields["children"]
+    return json.dumps(fields, ensure_ascii=False)
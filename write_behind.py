@@ -0,0 +1,215 @@
+"""
+Отложенная запись (write-behind) в Dropbox.
+
+Хендлер бота вызывает schedule_save(user_id, data) и сразу отвечает
+пользователю, а фоновый поток сливает серию правок в одно сохранение:
+сохраняем, когда правок не было FLUSH_DEBOUNCE_MS, но не позже
+FLUSH_MAX_DELAY_MS от первой несохранённой правки.
+
+Пользователи сохраняются параллельно (до FLUSH_WORKERS одновременно):
+медленная заливка одного не задерживает остальных, а сохранения одного
+пользователя уходят по очереди (storage.save_data). Замок пользователя
+сохранение держит, только пока снимает разделы, так что его хендлеры
+заливку не ждут.
+
+Неудачное сохранение повторяется с растущей паузой: FLUSH_RETRY_MS,
+вдвое больше после каждой следующей ошибки, но не больше FLUSH_RETRY_MAX_MS
+(чтобы упорно падающая запись – лимит Dropbox, плохой токен – не била
+в Dropbox каждые FLUSH_DEBOUNCE_MS).
+
+Изменения, которые не стоят отдельной заливки (контекст показанных
+списков), ставятся с low_priority: они уходят вместе с ближайшим обычным
+сохранением, а если правок нет – через CONTEXT_FLUSH_MS.
+
+При выходе процесса (atexit) и по SIGTERM очередь досливается синхронно.
+WRITE_BEHIND=0 выключает очередь – schedule_save сохраняет сразу, как раньше.
+"""
+
+import atexit
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from storage import save_data
+
+WRITE_BEHIND = os.environ.get("WRITE_BEHIND", "1") != "0"
+FLUSH_DEBOUNCE_MS = int(os.environ.get("FLUSH_DEBOUNCE_MS", "1500"))
+FLUSH_MAX_DELAY_MS = int(os.environ.get("FLUSH_MAX_DELAY_MS", "10000"))
+FLUSH_WORKERS = int(os.environ.get("FLUSH_WORKERS", "4"))
+FLUSH_RETRY_MS = int(os.environ.get("FLUSH_RETRY_MS", "2000"))
+FLUSH_RETRY_MAX_MS = int(os.environ.get("FLUSH_RETRY_MAX_MS", "300000"))
+CONTEXT_FLUSH_MS = int(os.environ.get("CONTEXT_FLUSH_MS", "300000"))
+
+
+class WriteBehindQueue:
+    """
+    Очередь пользователей, чьи данные нужно сохранить.
+    На каждого пользователя – одна запись, повторные schedule только
+    сдвигают момент сохранения (но не дальше max_delay от первой правки).
+    """
+
+    def __init__(self, flush, debounce_ms, max_delay_ms, workers=FLUSH_WORKERS,
+                 retry_ms=FLUSH_RETRY_MS, retry_max_ms=FLUSH_RETRY_MAX_MS,
+                 idle_ms=CONTEXT_FLUSH_MS):
+        self._flush = flush
+        self._debounce = debounce_ms / 1000
+        self._max_delay = max_delay_ms / 1000
+        self._retry = retry_ms / 1000
+        self._retry_max = retry_max_ms / 1000
+        self._idle = idle_ms / 1000
+        self._cond = threading.Condition()
+        # Сохранения разных пользователей идут в пуле параллельно
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="write-behind")
+        # {user_id: [data, first_ts, last_ts, idle_due]}; idle_due – срок
+        # записи только с low_priority (обычная правка его сбрасывает)
+        self._pending = {}
+        self._failures = {}  # {user_id: (ошибок подряд, не сохранять раньше)}
+        self._thread = None
+
+    def schedule(self, user_id, data, low_priority=False):
+        """
+        Поставить данные пользователя в очередь на сохранение.
+        low_priority – сохранить не позже чем через idle_ms, а если раньше
+        придёт обычная правка – вместе с ней.
+        """
+        now = time.monotonic()
+        with self._cond:
+            entry = self._pending.get(user_id)
+            if entry is None:
+                self._pending[user_id] = [data, now, now, now + self._idle if low_priority else None]
+            elif not low_priority:
+                if entry[3] is not None:
+                    entry[1] = now  # до этого в очереди была только запись с low_priority
+                    entry[3] = None
+                entry[0] = data
+                entry[2] = now
+            self._start()
+            self._cond.notify()
+
+    def _start(self):
+        # Поток очереди – при первой записи (вызывается под _cond)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def drain(self):
+        """Синхронно сохранить всё, что ждёт в очереди."""
+        with self._cond:
+            ready = [(user_id, entry[0]) for user_id, entry in self._pending.items()]
+            self._pending.clear()
+        wait(self._submit(ready))
+
+    def _take_ready(self):
+        """
+        Забрать из очереди тех, кому пора сохраняться.
+        Возвращает (готовые, сколько ждать до следующего срока или None).
+        """
+        now = time.monotonic()
+        ready = []
+        wait = None
+        for user_id, (data, first_ts, last_ts, idle_due) in list(self._pending.items()):
+            due = idle_due or min(last_ts + self._debounce, first_ts + self._max_delay)
+            if user_id in self._failures:
+                # После ошибки – не раньше, чем пройдёт пауза повтора
+                due = max(due, self._failures[user_id][1])
+            if due <= now:
+                ready.append((user_id, data))
+                del self._pending[user_id]
+            elif wait is None or due - now < wait:
+                wait = due - now
+        return ready, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                ready, wait = self._take_ready()
+                while not ready:
+                    self._cond.wait(wait)
+                    ready, wait = self._take_ready()
+            self._submit(ready)
+
+    def _submit(self, ready):
+        """Отдать сохранения в пул; вернуть их futures."""
+        futures = []
+        for user_id, data in ready:
+            try:
+                futures.append(self._pool.submit(self._save, user_id, data))
+            except RuntimeError:
+                # Процесс завершается и пул уже не принимает задачи – сохраняем здесь
+                self._save(user_id, data)
+        return futures
+
+    def _save(self, user_id, data):
+        try:
+            self._flush(user_id, data)
+        except Exception as e:
+            # Несохранённые разделы остались dirty – попробуем ещё раз позже
+            self._retry_later(user_id, data, e)
+        else:
+            with self._cond:
+                if self._failures.pop(user_id, None) is not None:
+                    print(f"[write-behind] save for user {user_id} succeeded after retries")
+
+    def _retry_later(self, user_id, data, error):
+        """Вернуть данные в очередь с паузой: FLUSH_RETRY_MS * 2**(ошибок - 1), не больше потолка."""
+        now = time.monotonic()
+        with self._cond:
+            failures = self._failures.get(user_id, (0, now))[0] + 1
+            delay = min(self._retry * 2 ** (failures - 1), self._retry_max)
+            self._failures[user_id] = (failures, now + delay)
+            entry = self._pending.get(user_id)
+            if entry is None:
+                self._pending[user_id] = [data, now, now, None]
+            self._start()
+            self._cond.notify()
+        print(f"[write-behind] save error for user {user_id} (attempt {failures}), retry in {delay:.1f} s: {error}")
+
+
+_queue = WriteBehindQueue(save_data, FLUSH_DEBOUNCE_MS, FLUSH_MAX_DELAY_MS)
+
+
+def schedule_save(user_id, data, low_priority=False):
+    """
+    Сохранить данные пользователя – через очередь или сразу (WRITE_BEHIND=0).
+    low_priority – см. WriteBehindQueue.schedule; без очереди такие
+    изменения просто дождутся следующего сохранения.
+    """
+    if WRITE_BEHIND:
+        _queue.schedule(user_id, data, low_priority)
+    elif not low_priority:
+        save_data(user_id, data)
+
+
+def drain():
+    """Дослить очередь (вызывается при остановке процесса)."""
+    _queue.drain()
+
+
+def _install_shutdown_hooks():
+    atexit.register(drain)
+
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+    except ValueError:
+        previous = None
+
+    def on_sigterm(signum, frame):
+        print("[write-behind] SIGTERM: flushing pending saves")
+        drain()
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            raise SystemExit(0)
+
+    try:
+        signal.signal(signal.SIGTERM, on_sigterm)
+    except ValueError:
+        # signal.signal работает только из главного потока –
+        # тогда остаётся atexit (а SIGTERM обрабатывает сам сервер).
+        print("[write-behind] SIGTERM handler not installed (not in main thread)")
+
+
+if WRITE_BEHIND:
+    _install_shutdown_hooks()